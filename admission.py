@@ -0,0 +1,200 @@
+import math
+import threading
+from time import monotonic
+
+
+class Rejected(Exception):
+    """A request was not admitted
+
+    `code` is the HTTP status to answer with (429 or 503) and
+    `retry_after` the whole number of seconds to send in Retry-After.
+    """
+
+    def __init__(self, message, code, retry_after):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimit:
+    """At most `limit` requests at once, with a bounded queue for the rest
+
+    A request that finds every slot taken waits in line, unless
+    `queue_size` requests are waiting already; a waiting request gives up
+    at its deadline. Both cases are rejected with a 503, so clients fail
+    fast instead of all timing out behind the slow requests.
+    """
+
+    def __init__(self, limit, queue_size):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queue_full = 0
+        self.timed_out = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline):
+        """Take a slot, waiting until the monotonic() `deadline` at most"""
+        with self._condition:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.queue_size:
+                    self.queue_full += 1
+                    raise Rejected("Server is busy, please retry", 503, 1)
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.limit:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            raise Rejected("Server is busy, please retry", 503, 1)
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+
+class TokenBucket:
+    """Per-client request rate limit, keyed by client address
+
+    Each client may make `rate` requests a second on average, with bursts
+    of up to `burst`. Clients whose bucket is full again are forgotten once
+    more than `max_clients` are tracked, so memory stays bounded.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        # client -> (tokens, monotonic() when they were counted)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """Use up one token of `client`'s bucket, or raise Rejected (429)"""
+        now = monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                self.limited += 1
+                raise Rejected("Too many requests, please slow down", 429, math.ceil((1 - tokens) / self.rate))
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > self.max_clients:
+                self._forget_idle(now)
+
+    def clients(self):
+        return len(self._buckets)
+
+    def _forget_idle(self, now):
+        idle = [
+            client for client, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate >= self.burst
+        ]
+        for client in idle:
+            del self._buckets[client]
+
+
+class AdmissionControl:
+    """Decides which requests run now, wait in line or are turned away
+
+    A request first spends a token from its client's bucket (when rate
+    limiting is on), then takes a slot on its route and a slot in the read
+    or write pool. Reads are GET, HEAD and OPTIONS, everything else is a
+    write. With separate pools a flood of slow collection GETs cannot keep
+    writes waiting, and with read_limit below the number of worker threads
+    some workers are always left for writes.
+
+    The whole wait, for both slots, is bounded by queue_timeout_ms.
+
+    Each process keeps its own limits and buckets, so in pre-fork mode the
+    limits apply per process.
+    """
+
+    def __init__(self, route_limit=None, read_limit=None, write_limit=None, route_limits=None,
+                 queue_size=16, queue_timeout_ms=1000, rate=None, burst=None):
+        self.route_limit = route_limit
+        # Limits for single routes, e.g. {"GET /books": 2}, that override
+        # route_limit
+        self.route_limits = dict(route_limits or {})
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.pools = {}
+        if read_limit is not None:
+            self.pools["read"] = ConcurrencyLimit(read_limit, queue_size)
+        if write_limit is not None:
+            self.pools["write"] = ConcurrencyLimit(write_limit, queue_size)
+        self.routes = {}
+        self.rate_limit = None
+        if rate is not None:
+            self.rate_limit = TokenBucket(rate, burst if burst is not None else max(1, rate))
+        self._lock = threading.Lock()
+
+    def admit(self, method, route, client):
+        """Admit a request or raise Rejected
+
+        Returns the limits taken, to be handed back to release() once the
+        response is written.
+        """
+        if self.rate_limit is not None:
+            self.rate_limit.take(client)
+
+        deadline = monotonic() + self.queue_timeout
+        taken = []
+        try:
+            for limit in (self._route(method, route), self.pools.get(self._pool(method))):
+                if limit is not None:
+                    limit.acquire(deadline)
+                    taken.append(limit)
+        except Rejected:
+            self.release(taken)
+            raise
+        return taken
+
+    def release(self, taken):
+        for limit in reversed(taken):
+            limit.release()
+
+    def stats(self):
+        """Counters of every pool and route limit, and of the rate limit"""
+        with self._lock:
+            limits = [("pool", name, limit) for name, limit in self.pools.items()]
+            limits.extend(("route", name, limit) for name, limit in sorted(self.routes.items()))
+        stats = {"limits": []}
+        for kind, name, limit in limits:
+            stats["limits"].append({
+                kind: name,
+                "limit": limit.limit,
+                "in_flight": limit.in_flight,
+                "waiting": limit.waiting,
+                "admitted": limit.admitted,
+                "queue_full": limit.queue_full,
+                "timed_out": limit.timed_out,
+            })
+        if self.rate_limit is not None:
+            stats["rate_limited"] = self.rate_limit.limited
+            stats["rate_limited_clients"] = self.rate_limit.clients()
+        return stats
+
+    def _pool(self, method):
+        return "read" if method in ("GET", "HEAD", "OPTIONS") else "write"
+
+    def _route(self, method, route):
+        key = f"{method} {route}"
+        limit = self.routes.get(key)
+        if limit is None:
+            size = self.route_limits.get(key, self.route_limit)
+            if size is None:
+                return None
+            with self._lock:
+                limit = self.routes.setdefault(key, ConcurrencyLimit(size, self.queue_size))
+        return limit
@@ -0,0 +1,112 @@
+"""Compare one-POST-per-row inserts with the bulk endpoints
+
+    python bench/bulk_import.py --rows 2000
+
+Starts json-server.py on a scratch copy of the database, inserts the same
+number of reviews and books through POST /reviews and POST /books one row
+at a time, then through POST /reviews/bulk and POST /books/bulk, and
+prints the throughput of each.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path, port, server_args=("--cache-mb", "0")):
+    server = subprocess.Popen(
+        [sys.executable, "json-server.py", "--port", str(port), "--db", db_path, *server_args],
+        cwd=ROOT, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("json-server.py did not start")
+
+
+def review_rows(count):
+    return [{"book_id": 1 + i % 9, "user_id": 1 + i % 4, "rating": 1 + i % 5, "review_text": f"Bench review {i}"}
+            for i in range(count)]
+
+
+def book_rows(count, prefix):
+    return [{"title": f"Bench book {i}", "author": "Bench Author", "isbn": f"{prefix}-{i}",
+             "publication_date": "2020-01-01", "user_id": 1 + i % 4, "categories": [1, 1 + i % 7]}
+            for i in range(count)]
+
+
+def post_each(conn, path, rows):
+    started = time.perf_counter()
+    for row in rows:
+        conn.request("POST", path, body=json.dumps(row), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 201:
+            raise RuntimeError(f"POST {path} returned {response.status}")
+    return time.perf_counter() - started
+
+
+def post_bulk(conn, path, rows):
+    body = "".join(json.dumps(row) + "\n" for row in rows)
+    started = time.perf_counter()
+    conn.request("POST", path, body=body, headers={"Content-Type": "application/x-ndjson"})
+    response = conn.getresponse()
+    report = json.loads(response.read())
+    elapsed = time.perf_counter() - started
+    if report["created"] != len(rows):
+        raise RuntimeError(f"POST {path} rejected rows: {report['errors'][:3]}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000, help="rows inserted by each method")
+    parser.add_argument("--db", default=os.path.join(ROOT, "janesreviews.sqlite3"), help="database to copy")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-bulk-")
+    db_path = os.path.join(workdir, "bench.sqlite3")
+    shutil.copy(args.db, db_path)
+    port = free_port()
+    server = start_server(db_path, port)
+
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        results = {}
+        results["reviews one by one"] = post_each(conn, "/reviews", review_rows(args.rows))
+        results["reviews bulk"] = post_bulk(conn, "/reviews/bulk", review_rows(args.rows))
+        results["books one by one"] = post_each(conn, "/books", book_rows(args.rows, "single"))
+        results["books bulk"] = post_bulk(conn, "/books/bulk", book_rows(args.rows, "bulk"))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+    print(f"{'method':<20} {'seconds':>8} {'rows/s':>10}")
+    for name, elapsed in results.items():
+        print(f"{name:<20} {elapsed:>8.2f} {args.rows / elapsed:>10.0f}")
+    for resource in ("reviews", "books"):
+        speedup = results[f"{resource} one by one"] / results[f"{resource} bulk"]
+        print(f"{resource}: bulk is {speedup:.0f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Fill a fresh database with synthetic books, reviews and categories
+
+    python bench/generate_dataset.py bench.sqlite3 --books 100000 --reviews 1000000
+
+Creates the schema from janesreviews.sql, inserts the requested number of
+rows and then applies the migrations, which build the indexes, rating
+stats and search tables from the generated data. Popularity is skewed the
+way real catalogs are: a few books get most of the reviews, a few users
+write most of them and a few categories hold most of the books. The same
+--seed always produces the same database.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+
+WORDS = """
+    river shadow garden winter silent house light secret city night ocean
+    stone glass letter summer empire queen forest memory storm island road
+    paper daughter fire clock mirror wolf north lost hidden last little
+    golden broken wild salt iron song dream bridge tower echo harbor
+""".split()
+
+PRAISE = """
+    loved gripping slow beautiful confusing brilliant predictable moving
+    dull clever tense charming haunting funny long short dense vivid
+""".split()
+
+
+def create_schema(conn):
+    """Create the tables from janesreviews.sql without its sample rows"""
+    with open(os.path.join(ROOT, "janesreviews.sql")) as schema_file:
+        script = schema_file.read()
+    conn.executescript(script)
+    conn.executescript("""
+        DELETE FROM BookCategory;
+        DELETE FROM Review;
+        DELETE FROM Category;
+        DELETE FROM Book;
+        DELETE FROM User;
+        DELETE FROM sqlite_sequence;
+    """)
+
+
+def skewed_weights(count, skew):
+    """Cumulative Zipf-like weights, so item 1 is the most popular"""
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def skewed_ids(rng, cum_weights, count):
+    """`count` ids between 1 and len(cum_weights), drawn with the given weights"""
+    ids = range(1, len(cum_weights) + 1)
+    return rng.choices(ids, cum_weights=cum_weights, k=count)
+
+
+def phrase(rng, words, length):
+    return " ".join(rng.choice(words) for _ in range(length))
+
+
+def user_rows(count):
+    for user_id in range(1, count + 1):
+        yield (f"reader{user_id}", f"reader{user_id}@example.com")
+
+
+def category_rows(count):
+    for category_id in range(1, count + 1):
+        yield (f"Category {category_id}",)
+
+
+def book_rows(rng, count, user_weights):
+    user_ids = skewed_ids(rng, user_weights, count)
+    for book_id in range(1, count + 1):
+        title = phrase(rng, WORDS, rng.randint(1, 4)).title()
+        author = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son"
+        published = f"{rng.randint(1950, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        yield (title, author, f"979-{book_id:010d}", published, user_ids[book_id - 1])
+
+
+def book_category_rows(rng, books, category_weights):
+    for book_id in range(1, books + 1):
+        # One to three distinct categories, the popular ones more often
+        categories = set(skewed_ids(rng, category_weights, rng.randint(1, 3)))
+        for category_id in sorted(categories):
+            yield (book_id, category_id)
+
+
+def review_rows(rng, count, book_weights, user_weights, batch_size=100000):
+    # Draw the skewed ids in batches so a large run does not hold them all
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        book_ids = skewed_ids(rng, book_weights, size)
+        user_ids = skewed_ids(rng, user_weights, size)
+        for book_id, user_id in zip(book_ids, user_ids):
+            # Ratings lean towards 4 and 5 stars
+            rating = rng.choices((1, 2, 3, 4, 5), weights=(1, 2, 4, 8, 6))[0]
+            text = f"{rng.choice(PRAISE).capitalize()}, {phrase(rng, WORDS + PRAISE, rng.randint(4, 20))}."
+            yield (book_id, user_id, rating, text)
+
+
+def generate(path, books, reviews, users, categories, skew, seed):
+    """Write a new database at path; returns the number of rows per table"""
+    rng = random.Random(seed)
+    user_weights = skewed_weights(users, skew)
+    book_weights = skewed_weights(books, skew)
+    category_weights = skewed_weights(categories, skew)
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    # Nothing to lose if generation is interrupted, so skip the journal
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_schema(conn)
+
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO User (username, email) VALUES (?, ?)", user_rows(users))
+    conn.executemany("INSERT INTO Category (category_name) VALUES (?)", category_rows(categories))
+    conn.executemany(
+        "INSERT INTO Book (title, author, isbn, publication_date, user_id) VALUES (?, ?, ?, ?, ?)",
+        book_rows(rng, books, user_weights),
+    )
+    conn.executemany(
+        "INSERT INTO BookCategory (book_id, category_id) VALUES (?, ?)",
+        book_category_rows(rng, books, category_weights),
+    )
+    conn.executemany(
+        "INSERT INTO Review (book_id, user_id, rating, review_text) VALUES (?, ?, ?, ?)",
+        review_rows(rng, reviews, book_weights, user_weights),
+    )
+    conn.execute("COMMIT")
+    conn.close()
+
+    # Indexes, BookStats and the search tables are built from the data
+    database.configure(path=path)
+    database.migrations.migrate()
+    with database.get_connection() as conn:
+        counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("User", "Category", "Book", "BookCategory", "Review")
+        }
+    database.close_all()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="database file to create")
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--reviews", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=0.8,
+                        help="Zipf exponent of book, user and category popularity, 0 for uniform")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="replace the file if it exists")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f"{args.path} exists, use --force to replace it")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    started = time.perf_counter()
+    counts = generate(args.path, args.books, args.reviews, args.users, args.categories, args.skew, args.seed)
+    elapsed = time.perf_counter() - started
+
+    for table, count in counts.items():
+        print(f"{table:<13} {count:>10}")
+    print(f"Generated {args.path} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
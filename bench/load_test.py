@@ -0,0 +1,315 @@
+"""Replay a mixed read/write workload against json-server.py
+
+    python bench/generate_dataset.py /tmp/bench.sqlite3
+    python bench/load_test.py --db /tmp/bench.sqlite3 --clients 16 --duration 30
+
+Starts the server on a scratch copy of --db (pass server flags with
+--server-arg, e.g. --server-arg=--processes=4), or targets a server that
+is already running with --url, in which case --db is only read to learn
+the id ranges. Each client thread keeps one keep-alive connection and
+picks requests from WORKLOAD by weight, asking for popular books and
+reviews more often than the rest.
+
+Prints throughput and p50/p95/p99 latency per route and saves the run as
+JSON under bench/results/ (or --output). --compare PREVIOUS.json prints
+how this run's numbers moved against an earlier one.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from bulk_import import ROOT, free_port, start_server
+from generate_dataset import WORDS, skewed_weights
+
+
+class Workload:
+    """Builds the requests the clients send, from the ids in the database"""
+
+    def __init__(self, db_path, skew, run_id):
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            self.max_book_id = conn.execute("SELECT MAX(id) FROM Book").fetchone()[0] or 1
+            self.max_review_id = conn.execute("SELECT MAX(id) FROM Review").fetchone()[0] or 1
+            self.max_user_id = conn.execute("SELECT MAX(id) FROM User").fetchone()[0] or 1
+            self.category_ids = [row[0] for row in conn.execute("SELECT id FROM Category")] or [1]
+        finally:
+            conn.close()
+
+        self.book_weights = skewed_weights(self.max_book_id, skew)
+        self.review_weights = skewed_weights(self.max_review_id, skew)
+        self.run_id = run_id
+        self.created_reviews = []
+        self.created_books = 0
+        self.lock = threading.Lock()
+
+    def popular_book(self, rng):
+        return rng.choices(range(1, self.max_book_id + 1), cum_weights=self.book_weights)[0]
+
+    def popular_review(self, rng):
+        return rng.choices(range(1, self.max_review_id + 1), cum_weights=self.review_weights)[0]
+
+    # Each request builder returns (method, path, body)
+
+    def list_books(self, rng):
+        return "GET", f"/books?limit=20&after={rng.randint(0, self.max_book_id)}", None
+
+    def get_book(self, rng):
+        return "GET", f"/books/{self.popular_book(rng)}", None
+
+    def book_stats(self, rng):
+        return "GET", f"/books/{self.popular_book(rng)}/stats", None
+
+    def search_books(self, rng):
+        return "GET", f"/books?limit=20&q={urllib.parse.quote(rng.choice(WORDS))}", None
+
+    def list_reviews(self, rng):
+        return "GET", f"/reviews?limit=20&after={rng.randint(0, self.max_review_id)}", None
+
+    def get_review(self, rng):
+        return "GET", f"/reviews/{self.popular_review(rng)}", None
+
+    def search_reviews(self, rng):
+        words = f"{rng.choice(WORDS)} {rng.choice(WORDS)}"
+        return "GET", f"/reviews?limit=20&q={urllib.parse.quote(words)}", None
+
+    def list_categories(self, rng):
+        return "GET", "/categories", None
+
+    def create_review(self, rng):
+        review = {
+            "book_id": self.popular_book(rng),
+            "user_id": rng.randint(1, self.max_user_id),
+            "rating": rng.randint(1, 5),
+            "review_text": f"Load test review, {rng.choice(WORDS)} {rng.choice(WORDS)}",
+        }
+        return "POST", "/reviews", review
+
+    def create_book(self, rng):
+        with self.lock:
+            self.created_books += 1
+            number = self.created_books
+        book = {
+            "title": f"Load test {rng.choice(WORDS)}",
+            "author": "Load Test",
+            "isbn": f"load-{self.run_id}-{number}",
+            "publication_date": "2024-01-01",
+            "user_id": rng.randint(1, self.max_user_id),
+            "categories": rng.sample(self.category_ids, min(2, len(self.category_ids))),
+        }
+        return "POST", "/books", book
+
+    def delete_review(self, rng):
+        # Only delete reviews this run created, so reads keep finding data
+        with self.lock:
+            review_id = self.created_reviews.pop() if self.created_reviews else None
+        if review_id is None:
+            return self.create_review(rng)
+        return "DELETE", f"/reviews/{review_id}", None
+
+    def record(self, route, response_body):
+        if route == "POST /reviews":
+            with self.lock:
+                self.created_reviews.append(json.loads(response_body)["id"])
+
+
+# (route, weight, request builder); the route names the latency bucket
+WORKLOAD = [
+    ("GET /books", 10, Workload.list_books),
+    ("GET /books/{id}", 25, Workload.get_book),
+    ("GET /books/{id}/stats", 5, Workload.book_stats),
+    ("GET /books?q=", 5, Workload.search_books),
+    ("GET /reviews", 10, Workload.list_reviews),
+    ("GET /reviews/{id}", 15, Workload.get_review),
+    ("GET /reviews?q=", 3, Workload.search_reviews),
+    ("GET /categories", 5, Workload.list_categories),
+    ("POST /reviews", 15, Workload.create_review),
+    ("POST /books", 2, Workload.create_book),
+    ("DELETE /reviews/{id}", 5, Workload.delete_review),
+]
+
+
+def run_client(host, port, workload, seed, warmup_until, stop_at, samples):
+    """Send requests until stop_at, appending (route, seconds, status) to samples"""
+    rng = random.Random(seed)
+    routes = [route for route, _, _ in WORKLOAD]
+    weights = [weight for _, weight, _ in WORKLOAD]
+    builders = {route: build for route, _, build in WORKLOAD}
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            break
+        route = rng.choices(routes, weights=weights)[0]
+        method, path, body = builders[route](workload, rng)
+        if body is not None:
+            body = json.dumps(body)
+
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response_body = response.read()
+            code = response.status
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            code = "error"
+            conn.close()
+        elapsed = time.perf_counter() - started
+
+        if code in (200, 201):
+            workload.record(route, response_body)
+        if started >= warmup_until:
+            samples.append((route, elapsed, code))
+
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, round(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, duration):
+    """Per-route and overall throughput, latency percentiles and status counts"""
+    by_route = {}
+    for route, elapsed, code in samples:
+        by_route.setdefault(route, []).append((elapsed, code))
+    by_route["all"] = [(elapsed, code) for _, elapsed, code in samples]
+
+    summary = {}
+    for route, route_samples in by_route.items():
+        latencies = sorted(elapsed * 1000 for elapsed, _ in route_samples)
+        statuses = {}
+        for _, code in route_samples:
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+        summary[route] = {
+            "requests": len(route_samples),
+            "errors": sum(count for code, count in statuses.items() if code == "error" or code >= "500"),
+            "statuses": statuses,
+            "throughput": len(route_samples) / duration,
+            "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": latencies[-1],
+        }
+    return summary
+
+
+def print_summary(summary, previous=None):
+    header = f"{'route':<24} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if previous:
+        header += f" {'p95 vs prev':>12}"
+    print(header)
+    for route, stats in sorted(summary.items(), key=lambda item: (item[0] == "all", item[0])):
+        line = (f"{route:<24} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>9.1f} "
+                f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+        if previous and route in previous:
+            change = (stats["p95_ms"] - previous[route]["p95_ms"]) / previous[route]["p95_ms"] * 100
+            line += f" {change:>+11.0f}%"
+        print(line)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.path.join(ROOT, "janesreviews.sqlite3"), help="database to load test")
+    parser.add_argument("--url", help="test a running server, e.g. http://127.0.0.1:8000, instead of starting one")
+    parser.add_argument("--server-arg", action="append", default=[], help="extra json-server.py flag, repeatable")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of load before measuring starts")
+    parser.add_argument("--skew", type=float, default=0.8, help="Zipf exponent of book and review popularity")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="where to save the JSON results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    started_at = datetime.datetime.now()
+    run_id = started_at.strftime("%Y%m%d-%H%M%S")
+    workload = Workload(args.db, args.skew, run_id)
+
+    workdir = server = None
+    if args.url:
+        target = urllib.parse.urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        # Writes would change the dataset between runs, so use a copy
+        workdir = tempfile.mkdtemp(prefix="bench-load-")
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        shutil.copy(args.db, db_path)
+        host, port = "127.0.0.1", free_port()
+        server = start_server(db_path, port, args.server_arg)
+
+    try:
+        samples = []
+        warmup_until = time.perf_counter() + args.warmup
+        stop_at = warmup_until + args.duration
+        clients = [
+            threading.Thread(target=run_client,
+                             args=(host, port, workload, args.seed + number, warmup_until, stop_at, samples))
+            for number in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workdir)
+
+    if not samples:
+        raise SystemExit("No requests completed")
+
+    summary = summarize(samples, args.duration)
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)["routes"]
+    print_summary(summary, previous)
+
+    results = {
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "settings": vars(args),
+        "dataset": {
+            "books": workload.max_book_id,
+            "reviews": workload.max_review_id,
+            "users": workload.max_user_id,
+            "categories": len(workload.category_ids),
+        },
+        "routes": summary,
+    }
+    output = args.output or os.path.join(ROOT, "bench", "results", f"load-{run_id}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Show that GET /books/top stays flat as the catalog grows
+
+    python bench/top_books.py --sizes 10000,100000,400000
+
+Generates a catalog of each size with generate_dataset.py (ten reviews
+per book by default), starts json-server.py on it with the response cache
+off and times the leaderboard overall, in the largest and smallest
+category and with a min_reviews filter. For contrast it also times the
+query the leaderboard replaces, which computes and sorts the score of
+every book. Generated catalogs are kept in --workdir and reused.
+"""
+import argparse
+import http.client
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from bulk_import import free_port, start_server  # noqa: E402
+from generate_dataset import generate  # noqa: E402
+
+# Ranks every book per request, the way the leaderboard would without
+# the score column and its index
+FULL_SORT = """
+SELECT book_id
+FROM BookStats
+WHERE review_count >= 1
+ORDER BY (rating_sum + 30.0) / (review_count + 10) DESC
+LIMIT 10
+"""
+
+
+def catalog(workdir, books, reviews_per_book):
+    """Path of a generated catalog with `books` books, generating it if needed"""
+    path = os.path.join(workdir, f"top-{books}.sqlite3")
+    if not os.path.exists(path):
+        print(f"Generating {books} books...", flush=True)
+        generate(path, books, books * reviews_per_book, max(100, books // 10), 50, 0.8, 1)
+    return path
+
+
+def time_requests(conn, path, requests):
+    """Median and p95 milliseconds of `requests` GETs of path"""
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status != 200:
+            raise RuntimeError(f"GET {path} returned {response.status}")
+    timings.sort()
+    return statistics.median(timings), timings[max(0, round(0.95 * len(timings)) - 1)]
+
+
+def time_full_sort(path, requests):
+    conn = sqlite3.connect(path)
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        conn.execute(FULL_SORT).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    timings.sort()
+    return statistics.median(timings), timings[max(0, round(0.95 * len(timings)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="comma separated catalog sizes, in books")
+    parser.add_argument("--reviews-per-book", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="requests timed per case")
+    parser.add_argument("--workdir", default=os.path.join(ROOT, "bench", "results"),
+                        help="directory the generated catalogs are kept in")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    rows = []
+    for books in sizes:
+        path = catalog(args.workdir, books, args.reviews_per_book)
+        with sqlite3.connect(path) as conn:
+            by_size = conn.execute("SELECT category_id FROM CategoryStats ORDER BY book_count DESC").fetchall()
+        cases = {
+            "top 10": "/books/top?limit=10",
+            "top 10, largest category": f"/books/top?limit=10&category={by_size[0][0]}",
+            "top 10, smallest category": f"/books/top?limit=10&category={by_size[-1][0]}",
+            "top 10, min_reviews=20": "/books/top?limit=10&min_reviews=20",
+        }
+
+        port = free_port()
+        server = start_server(path, port)
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            for name, url in cases.items():
+                # The first requests warm SQLite's page cache
+                time_requests(conn, url, 10)
+                rows.append((books, name, *time_requests(conn, url, args.requests)))
+        finally:
+            server.terminate()
+            server.wait()
+        rows.append((books, "full sort (SQL only)", *time_full_sort(path, max(1, args.requests // 10))))
+
+    print(f"{'books':>8}  {'case':<28} {'median ms':>10} {'p95 ms':>8}")
+    for books, name, median, p95 in rows:
+        print(f"{books:>8}  {name:<28} {median:>10.2f} {p95:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
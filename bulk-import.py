@@ -0,0 +1,72 @@
+"""Load books or reviews from a file without going through the HTTP server
+
+    python bulk-import.py books catalog.ndjson
+    python bulk-import.py reviews reviews.json --db /path/to/janesreviews.sqlite3
+
+The file holds either a JSON array of objects or NDJSON (one object per
+line); use - to read from standard input. Rows use the same fields as
+POST /books and POST /reviews.
+"""
+import argparse
+import json
+import sys
+import time
+
+import database
+from views import Books, Reviews
+
+
+def read_rows(source):
+    """Yield the rows of a JSON array or NDJSON file"""
+    first_line = source.readline()
+    if first_line.lstrip().startswith("["):
+        # A JSON array has to be parsed in one go
+        yield from json.loads(first_line + source.read())
+        return
+
+    for line in _lines(first_line, source):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _lines(first_line, source):
+    yield first_line
+    yield from source
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import books or reviews")
+    parser.add_argument("resource", choices=("books", "reviews"))
+    parser.add_argument("file", help="JSON array or NDJSON file, - for standard input")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per transaction")
+    parser.add_argument("--db", help="path of the SQLite database file")
+    args = parser.parse_args()
+
+    if args.db:
+        database.configure(path=args.db)
+    database.migrations.migrate()
+
+    if args.resource == "books":
+        view = Books()
+    else:
+        view = Reviews()
+
+    source = sys.stdin if args.file == "-" else open(args.file)
+    started = time.perf_counter()
+    with source:
+        report = json.loads(view.bulk_create(read_rows(source), args.batch_size))
+    elapsed = time.perf_counter() - started
+
+    for error in report["errors"]:
+        print(f"Row {error['index']}: {error['error']}", file=sys.stderr)
+    rate = report["created"] / elapsed if elapsed else 0
+    print(f"Created {report['created']} {args.resource} in {elapsed:.2f}s ({rate:.0f} rows/s), {len(report['errors'])} rows rejected")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
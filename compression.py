@@ -0,0 +1,52 @@
+import zlib
+
+
+# Content codings the server can produce, best first
+ENCODINGS = ("gzip", "deflate")
+
+
+def choose_encoding(accept_encoding):
+    """Pick the content coding to use for an Accept-Encoding header
+
+    Returns "gzip", "deflate" or None when the client accepts neither.
+    Quality values are honoured, so "gzip;q=0" rules gzip out, and "*"
+    stands for any coding not listed by name.
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def compressor(encoding, level=6):
+    """A zlib compress object producing the given content coding"""
+    if encoding == "gzip":
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    # HTTP's "deflate" is the zlib format, not a raw deflate stream
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+
+
+def compress(data, encoding, level=6):
+    """Compress a whole body with the given content coding"""
+    compress_object = compressor(encoding, level)
+    return compress_object.compress(data) + compress_object.flush()
@@ -0,0 +1,3 @@
+from .connection import configure, get_connection, close_all, data_version, settings
+from .replica import get_read_connection
+from . import aggregates, bulk, instrument, migrations, plans, replica, search, slow_queries, writer
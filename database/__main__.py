@@ -0,0 +1,110 @@
+"""Maintenance commands for the Jane's Reviews database
+
+    python -m database [--db PATH] <command>
+"""
+import argparse
+import sys
+
+from . import aggregates, configure, migrations, plans, search, slow_queries
+
+
+def rebuild_stats(args):
+    count = aggregates.rebuild_book_stats()
+    print(f"Rebuilt rating stats for {count} books")
+    count = aggregates.rebuild_category_stats()
+    print(f"Rebuilt book counts for {count} categories")
+    count = aggregates.rebuild_user_stats()
+    print(f"Rebuilt review counts for {count} users")
+
+
+def check_stats(args):
+    mismatches = aggregates.check_book_stats()
+    for book_id, stored, expected in mismatches:
+        print(f"Book {book_id}: stored {stored}, expected {expected}")
+    category_mismatches = aggregates.check_category_stats()
+    for category_id, stored, expected in category_mismatches:
+        print(f"Category {category_id}: stored {stored} books, expected {expected}")
+    user_mismatches = aggregates.check_user_stats()
+    for user_id, stored, expected in user_mismatches:
+        print(f"User {user_id}: stored {stored} reviews, expected {expected}")
+    if mismatches:
+        print(f"{len(mismatches)} books have stale rating stats, run rebuild-stats to fix them")
+    if category_mismatches:
+        print(f"{len(category_mismatches)} categories have stale book counts, run rebuild-stats to fix them")
+    if user_mismatches:
+        print(f"{len(user_mismatches)} users have stale review counts, run rebuild-stats to fix them")
+    if mismatches or category_mismatches or user_mismatches:
+        return 1
+    print("Rating stats, category book counts and user review counts are consistent")
+    return 0
+
+
+def migrate(args):
+    for version, description in migrations.migrate():
+        print(f"Applied migration {version}: {description}")
+    print(f"Database is at version {migrations.current_version()}")
+
+
+def check_indexes(args):
+    problems = plans.find_table_scans()
+    for name, plan in problems:
+        print(f"{name} scans a table or sorts without an index:")
+        for detail in plan:
+            print(f"    {detail}")
+    if problems:
+        return 1
+    print(f"All {len(plans.HOT_QUERIES)} hot queries use indexes")
+    return 0
+
+
+def rebuild_search(args):
+    search.rebuild_search_indexes()
+    print("Rebuilt the book and review search indexes")
+
+
+def slow_report(args):
+    with open(args.log) as log_file:
+        groups = slow_queries.report(log_file)
+    for group in groups[:args.top]:
+        print(f"{group['total_ms']:.1f} ms total, {group['count']} calls, "
+              f"mean {group['mean_ms']:.1f} ms, p95 {group['p95_ms']:.1f} ms, max {group['max_ms']:.1f} ms, "
+              f"{group['rows']} rows")
+        print(f"    {group['statement']}")
+        for caller in group["callers"]:
+            print(f"    called from {caller}")
+        for detail in group["plan"]:
+            marker = "!" if detail in group["scans"] else " "
+            print(f"  {marker} {detail}")
+        print()
+    if not groups:
+        print("No slow queries logged")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m database", description="Jane's Reviews database maintenance")
+    parser.add_argument("--db", help="path of the SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate", help="apply pending schema migrations").set_defaults(run=migrate)
+    commands.add_parser("check-indexes", help="EXPLAIN the hot queries and fail if any scans a table or sorts without an index").set_defaults(run=check_indexes)
+    commands.add_parser("rebuild-stats", help="recompute per-book rating stats, per-category book counts and per-user review counts").set_defaults(run=rebuild_stats)
+    commands.add_parser("rebuild-search", help="rebuild the full-text search indexes from the Book and Review tables").set_defaults(run=rebuild_search)
+    commands.add_parser("check-stats", help="report books, categories and users whose stored stats are stale").set_defaults(run=check_stats)
+    report_parser = commands.add_parser("slow-report", help="summarize a slow-query log, most total time first")
+    report_parser.add_argument("log", nargs="?", default=slow_queries.DEFAULT_LOG_PATH, help="slow-query log file")
+    report_parser.add_argument("--top", type=int, default=20, help="statements to show")
+    # Reading a log needs no database
+    report_parser.set_defaults(run=slow_report, needs_database=False)
+
+    args = parser.parse_args()
+    if args.db:
+        configure(path=args.db)
+
+    if getattr(args, "needs_database", True):
+        migrations.migrate()
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+from .connection import get_connection
+
+
+# Per-book review aggregates. Triggers on Review keep the counts current
+# as reviews are added, changed or removed, so reads never recount them.
+BOOK_STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS BookStats (
+    book_id INTEGER PRIMARY KEY,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (book_id) REFERENCES Book(id)
+);
+
+CREATE TRIGGER IF NOT EXISTS BookStats_after_review_insert
+AFTER INSERT ON Review
+BEGIN
+    INSERT OR IGNORE INTO BookStats (book_id) VALUES (NEW.book_id);
+    UPDATE BookStats
+    SET review_count = review_count + 1,
+        rating_sum = rating_sum + NEW.rating,
+        rating_1 = rating_1 + (NEW.rating = 1),
+        rating_2 = rating_2 + (NEW.rating = 2),
+        rating_3 = rating_3 + (NEW.rating = 3),
+        rating_4 = rating_4 + (NEW.rating = 4),
+        rating_5 = rating_5 + (NEW.rating = 5)
+    WHERE book_id = NEW.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS BookStats_after_review_delete
+AFTER DELETE ON Review
+BEGIN
+    UPDATE BookStats
+    SET review_count = review_count - 1,
+        rating_sum = rating_sum - OLD.rating,
+        rating_1 = rating_1 - (OLD.rating = 1),
+        rating_2 = rating_2 - (OLD.rating = 2),
+        rating_3 = rating_3 - (OLD.rating = 3),
+        rating_4 = rating_4 - (OLD.rating = 4),
+        rating_5 = rating_5 - (OLD.rating = 5)
+    WHERE book_id = OLD.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS BookStats_after_review_update
+AFTER UPDATE OF book_id, rating ON Review
+BEGIN
+    UPDATE BookStats
+    SET review_count = review_count - 1,
+        rating_sum = rating_sum - OLD.rating,
+        rating_1 = rating_1 - (OLD.rating = 1),
+        rating_2 = rating_2 - (OLD.rating = 2),
+        rating_3 = rating_3 - (OLD.rating = 3),
+        rating_4 = rating_4 - (OLD.rating = 4),
+        rating_5 = rating_5 - (OLD.rating = 5)
+    WHERE book_id = OLD.book_id;
+    INSERT OR IGNORE INTO BookStats (book_id) VALUES (NEW.book_id);
+    UPDATE BookStats
+    SET review_count = review_count + 1,
+        rating_sum = rating_sum + NEW.rating,
+        rating_1 = rating_1 + (NEW.rating = 1),
+        rating_2 = rating_2 + (NEW.rating = 2),
+        rating_3 = rating_3 + (NEW.rating = 3),
+        rating_4 = rating_4 + (NEW.rating = 4),
+        rating_5 = rating_5 + (NEW.rating = 5)
+    WHERE book_id = NEW.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS BookStats_after_book_delete
+AFTER DELETE ON Book
+BEGIN
+    DELETE FROM BookStats WHERE book_id = OLD.id;
+END;
+"""
+
+# Computes every row of BookStats from the Review table
+COMPUTE_BOOK_STATS = """
+SELECT
+    b.id AS book_id,
+    COUNT(r.id) AS review_count,
+    COALESCE(SUM(r.rating), 0) AS rating_sum,
+    COALESCE(SUM(r.rating = 1), 0) AS rating_1,
+    COALESCE(SUM(r.rating = 2), 0) AS rating_2,
+    COALESCE(SUM(r.rating = 3), 0) AS rating_3,
+    COALESCE(SUM(r.rating = 4), 0) AS rating_4,
+    COALESCE(SUM(r.rating = 5), 0) AS rating_5
+FROM Book b
+LEFT JOIN Review r ON r.book_id = b.id
+GROUP BY b.id
+"""
+
+# Leaderboard score: the average rating pulled towards SCORE_PRIOR_MEAN as
+# if every book also had SCORE_PRIOR_WEIGHT reviews of that rating, so a
+# single 5-star review does not top the chart. The score is a virtual
+# column computed from review_count and rating_sum; the index on it is
+# updated by the same trigger writes that keep BookStats current. Changing
+# the prior means a migration that recreates the column and its index.
+SCORE_PRIOR_MEAN = 3.0
+SCORE_PRIOR_WEIGHT = 10
+
+BOOK_SCORE_SCHEMA = f"""
+ALTER TABLE BookStats ADD COLUMN score REAL GENERATED ALWAYS AS (
+    (rating_sum + {SCORE_PRIOR_MEAN * SCORE_PRIOR_WEIGHT}) / (review_count + {SCORE_PRIOR_WEIGHT})
+) VIRTUAL;
+
+-- Best first; ties go to the book with more reviews, then the lower id
+CREATE INDEX IF NOT EXISTS BookStats_score
+    ON BookStats (score DESC, review_count DESC);
+"""
+
+# Number of books in each category. BookCategory holds each (book,
+# category) pair at most once, so counting its rows counts books.
+CATEGORY_STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS CategoryStats (
+    category_id INTEGER PRIMARY KEY,
+    book_count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (category_id) REFERENCES Category(id)
+);
+
+CREATE TRIGGER IF NOT EXISTS CategoryStats_after_book_category_insert
+AFTER INSERT ON BookCategory
+BEGIN
+    INSERT OR IGNORE INTO CategoryStats (category_id) VALUES (NEW.category_id);
+    UPDATE CategoryStats SET book_count = book_count + 1 WHERE category_id = NEW.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS CategoryStats_after_book_category_delete
+AFTER DELETE ON BookCategory
+BEGIN
+    UPDATE CategoryStats SET book_count = book_count - 1 WHERE category_id = OLD.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS CategoryStats_after_book_category_update
+AFTER UPDATE OF category_id ON BookCategory
+BEGIN
+    UPDATE CategoryStats SET book_count = book_count - 1 WHERE category_id = OLD.category_id;
+    INSERT OR IGNORE INTO CategoryStats (category_id) VALUES (NEW.category_id);
+    UPDATE CategoryStats SET book_count = book_count + 1 WHERE category_id = NEW.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS CategoryStats_after_category_delete
+AFTER DELETE ON Category
+BEGIN
+    DELETE FROM CategoryStats WHERE category_id = OLD.id;
+END;
+"""
+
+# Number of reviews each user has written, for profile pages
+USER_STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS UserStats (
+    user_id INTEGER PRIMARY KEY,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES User(id)
+);
+
+CREATE TRIGGER IF NOT EXISTS UserStats_after_review_insert
+AFTER INSERT ON Review
+BEGIN
+    INSERT OR IGNORE INTO UserStats (user_id) VALUES (NEW.user_id);
+    UPDATE UserStats SET review_count = review_count + 1 WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserStats_after_review_delete
+AFTER DELETE ON Review
+BEGIN
+    UPDATE UserStats SET review_count = review_count - 1 WHERE user_id = OLD.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserStats_after_review_update
+AFTER UPDATE OF user_id ON Review
+BEGIN
+    UPDATE UserStats SET review_count = review_count - 1 WHERE user_id = OLD.user_id;
+    INSERT OR IGNORE INTO UserStats (user_id) VALUES (NEW.user_id);
+    UPDATE UserStats SET review_count = review_count + 1 WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserStats_after_user_delete
+AFTER DELETE ON User
+BEGIN
+    DELETE FROM UserStats WHERE user_id = OLD.id;
+END;
+"""
+
+# Computes every row of UserStats from the Review table
+COMPUTE_USER_STATS = """
+SELECT
+    user_id,
+    COUNT(*) AS review_count
+FROM Review
+GROUP BY user_id
+"""
+
+# Computes every row of CategoryStats from the BookCategory table
+COMPUTE_CATEGORY_STATS = """
+SELECT
+    c.id AS category_id,
+    COUNT(bc.id) AS book_count
+FROM Category c
+LEFT JOIN BookCategory bc ON bc.category_id = c.id
+GROUP BY c.id
+"""
+
+_STATS_COLUMNS = ("review_count", "rating_sum", "rating_1", "rating_2", "rating_3", "rating_4", "rating_5")
+
+
+def rebuild_book_stats():
+    """Recompute BookStats from scratch; returns the number of books"""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM BookStats")
+        cursor = conn.execute(f"INSERT INTO BookStats {COMPUTE_BOOK_STATS}")
+        return cursor.rowcount
+
+
+def check_book_stats():
+    """Compare BookStats with the Review table
+
+    Returns a list of (book_id, stored, expected) tuples for every book
+    whose stored aggregates disagree with a fresh count.
+    """
+    with get_connection() as conn:
+        stored = {}
+        for row in conn.execute("SELECT * FROM BookStats"):
+            stored[row["book_id"]] = tuple(row[column] for column in _STATS_COLUMNS)
+
+        mismatches = []
+        for row in conn.execute(COMPUTE_BOOK_STATS):
+            expected = tuple(row[column] for column in _STATS_COLUMNS)
+            # Books nobody has reviewed may not have a BookStats row yet
+            actual = stored.pop(row["book_id"], (0,) * len(_STATS_COLUMNS))
+            if actual != expected:
+                mismatches.append((row["book_id"], actual, expected))
+
+        # Anything left over belongs to a book that no longer exists
+        for book_id, actual in stored.items():
+            mismatches.append((book_id, actual, None))
+
+        return mismatches
+
+
+def rebuild_category_stats():
+    """Recompute CategoryStats from scratch; returns the number of categories"""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM CategoryStats")
+        cursor = conn.execute(f"INSERT INTO CategoryStats {COMPUTE_CATEGORY_STATS}")
+        return cursor.rowcount
+
+
+def check_category_stats():
+    """Compare CategoryStats with the BookCategory table
+
+    Returns a list of (category_id, stored, expected) tuples for every
+    category whose stored book count disagrees with a fresh count.
+    """
+    with get_connection() as conn:
+        stored = {}
+        for row in conn.execute("SELECT * FROM CategoryStats"):
+            stored[row["category_id"]] = row["book_count"]
+
+        mismatches = []
+        for row in conn.execute(COMPUTE_CATEGORY_STATS):
+            # Empty categories may not have a CategoryStats row yet
+            actual = stored.pop(row["category_id"], 0)
+            if actual != row["book_count"]:
+                mismatches.append((row["category_id"], actual, row["book_count"]))
+
+        for category_id, actual in stored.items():
+            mismatches.append((category_id, actual, None))
+
+        return mismatches
+
+
+def rebuild_user_stats():
+    """Recompute UserStats from scratch; returns the number of users"""
+    with get_connection() as conn:
+        conn.execute("DELETE FROM UserStats")
+        cursor = conn.execute(f"INSERT INTO UserStats {COMPUTE_USER_STATS}")
+        return cursor.rowcount
+
+
+def check_user_stats():
+    """Compare UserStats with the Review table
+
+    Returns a list of (user_id, stored, expected) tuples for every user
+    whose stored review count disagrees with a fresh count.
+    """
+    with get_connection() as conn:
+        stored = {}
+        for row in conn.execute("SELECT * FROM UserStats"):
+            stored[row["user_id"]] = row["review_count"]
+
+        mismatches = []
+        for row in conn.execute(COMPUTE_USER_STATS):
+            actual = stored.pop(row["user_id"], 0)
+            if actual != row["review_count"]:
+                mismatches.append((row["user_id"], actual, row["review_count"]))
+
+        # Users whose reviews were all deleted keep a row with a count of 0
+        for user_id, actual in stored.items():
+            if actual != 0:
+                mismatches.append((user_id, actual, 0))
+
+        return mismatches
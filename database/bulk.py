@@ -0,0 +1,60 @@
+import sqlite3
+
+
+# Errors caused by the data in one row rather than by the database itself
+ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+
+def batches(rows, batch_size):
+    """Split an iterable into lists of (index, row) pairs of batch_size"""
+    batch = []
+    for index, row in enumerate(rows):
+        batch.append((index, row))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_batch(conn, sql, indexed_params):
+    """Insert one batch of rows in a single transaction
+
+    `indexed_params` is a list of (index, params) pairs. The whole batch is
+    tried with executemany first; if any row violates a constraint the batch
+    is rolled back and retried one row at a time, each row in a savepoint,
+    so only the bad rows are rejected.
+
+    Returns the number of rows inserted and a list of per-row errors.
+    """
+    try:
+        with conn:
+            conn.executemany(sql, [params for _, params in indexed_params])
+        return len(indexed_params), []
+    except ROW_ERRORS:
+        pass
+
+    inserted = 0
+    errors = []
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for index, params in indexed_params:
+            conn.execute("SAVEPOINT bulk_row")
+            try:
+                conn.execute(sql, params)
+                inserted += 1
+            except ROW_ERRORS as error:
+                conn.execute("ROLLBACK TO bulk_row")
+                errors.append({"index": index, "error": str(error)})
+            conn.execute("RELEASE bulk_row")
+    return inserted, errors
+
+
+def missing_fields(row, fields):
+    """Error message for a bulk row that is not usable, or None if it is"""
+    if not isinstance(row, dict):
+        return "row must be a JSON object"
+    missing = [field for field in fields if field not in row]
+    if missing:
+        return "missing fields: " + ", ".join(missing)
+    return None
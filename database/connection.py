@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+
+from .instrument import InstrumentedConnection
+
+
+# Path of the database file, override with the JANESREVIEWS_DB environment
+# variable or by calling configure() before the first connection is opened
+DEFAULT_DATABASE_PATH = "./janesreviews.sqlite3"
+
+settings = {
+    "path": os.environ.get("JANESREVIEWS_DB", DEFAULT_DATABASE_PATH),
+    "busy_timeout_ms": 5000,
+    "cache_size_kib": 64 * 1024,
+    "mmap_size_bytes": 256 * 1024 * 1024,
+    # Count statements, rows and SQLite time per thread (see instrument.py)
+    "instrument": True,
+}
+
+_local = threading.local()
+_open_connections = set()
+_lock = threading.Lock()
+
+# Bumped by close_all() so threads know their cached connection is gone
+_generation = 0
+
+# Dedicated connection used by data_version()
+_version_connection = None
+_version_connection_generation = -1
+
+
+def configure(**options):
+    """Change connection settings and drop any connections already open
+
+    Accepts the same keys as the settings dictionary, e.g.
+    configure(path="/var/lib/janesreviews.sqlite3", busy_timeout_ms=10000)
+    """
+    for key in options:
+        if key not in settings:
+            raise KeyError(f"Unknown database setting: {key}")
+    settings.update(options)
+    close_all()
+
+
+def get_connection():
+    """Get the calling thread's connection to the database
+
+    Connections stay open between requests, so the schema and page cache
+    are only loaded once per thread. Use the connection as a context manager
+    (`with get_connection() as conn:`) to commit or roll back a transaction.
+    """
+    conn = getattr(_local, "connection", None)
+    if conn is None or _local.generation != _generation:
+        conn = _open_connection()
+        with _lock:
+            _open_connections.add(conn)
+            _local.generation = _generation
+        _local.connection = conn
+    return conn
+
+
+def data_version():
+    """Number that changes whenever another connection commits a write
+
+    Useful for noticing writes made by other processes. Uses one dedicated
+    connection per process, since PRAGMA data_version is per connection.
+    """
+    global _version_connection, _version_connection_generation
+    with _lock:
+        if _version_connection is None or _version_connection_generation != _generation:
+            _version_connection = _open_connection()
+            _open_connections.add(_version_connection)
+            _version_connection_generation = _generation
+        return _version_connection.execute("PRAGMA data_version").fetchone()[0]
+
+
+def close_all():
+    """Close every connection opened by any thread"""
+    global _generation
+    with _lock:
+        connections = list(_open_connections)
+        _open_connections.clear()
+        _generation += 1
+    for conn in connections:
+        conn.close()
+
+
+def _forget_inherited_connections():
+    """Drop the parent's connections in a forked child without closing them
+
+    A SQLite connection must not be used across fork(), and closing it in
+    the child could disturb the parent's locks, so the child only forgets it.
+    """
+    global _generation
+    _open_connections.clear()
+    _generation += 1
+
+
+os.register_at_fork(after_in_child=_forget_inherited_connections)
+
+
+def _open_connection():
+    """Open a new connection and apply the tuned pragmas"""
+    # IMMEDIATE makes every write transaction take the write lock up front,
+    # so concurrent writers (threads or processes) wait in the busy handler
+    # instead of failing with "database is locked" when upgrading a lock
+    conn = sqlite3.connect(
+        settings["path"],
+        timeout=settings["busy_timeout_ms"] / 1000,
+        isolation_level="IMMEDIATE",
+        check_same_thread=False,
+        factory=InstrumentedConnection if settings["instrument"] else sqlite3.Connection,
+    )
+    conn.row_factory = sqlite3.Row
+
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout_ms'])}")
+    # A negative cache_size is measured in KiB instead of pages
+    conn.execute(f"PRAGMA cache_size = -{int(settings['cache_size_kib'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size_bytes'])}")
+
+    return conn
@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+from time import perf_counter
+
+
+# Work done by the calling thread since its last reset(). A request is
+# handled start to finish on one thread, so resetting at the start of each
+# request gives per-request numbers.
+_local = threading.local()
+
+# Set by slow_queries.enable(); None while the slow-query log is off
+slow_query_log = None
+
+
+class QueryCounts:
+    """SQL statements run, rows fetched and seconds spent inside SQLite"""
+    __slots__ = ("statements", "rows", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+
+def reset():
+    """Start counting from zero for the calling thread; returns the counts"""
+    _local.counts = QueryCounts()
+    return _local.counts
+
+
+def counts():
+    """The calling thread's counts since its last reset()"""
+    counts = getattr(_local, "counts", None)
+    if counts is None:
+        counts = reset()
+    return counts
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that adds its statements, rows and time to the thread's counts
+
+    Time spent stepping through rows counts as SQLite time, so the time a
+    request spends elsewhere is Python work: building dicts, json.dumps
+    and so on.
+
+    While the slow-query log is on, the cursor also follows its current
+    statement until the last row is fetched (or the cursor is reused or
+    dropped) and hands it to the log if it took too long.
+    """
+    _statement = None
+    _statement_seconds = 0.0
+    _statement_rows = 0
+
+    def execute(self, sql, parameters=()):
+        if self._statement is not None:
+            self._finish_statement()
+        started = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            seconds = perf_counter() - started
+            query_counts = counts()
+            query_counts.statements += 1
+            query_counts.seconds += seconds
+            if slow_query_log is not None:
+                self._start_statement(sql, parameters, seconds)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._statement is not None:
+            self._finish_statement()
+        started = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            seconds = perf_counter() - started
+            query_counts = counts()
+            query_counts.statements += 1
+            query_counts.seconds += seconds
+            if slow_query_log is not None:
+                # The parameter sets may be a consumed generator
+                self._start_statement(sql, None, seconds)
+
+    def fetchone(self):
+        started = perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, perf_counter() - started, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        started = perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(len(rows), perf_counter() - started, len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), perf_counter() - started, True)
+        return rows
+
+    def __next__(self):
+        started = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(0, perf_counter() - started, True)
+            raise
+        self._fetched(1, perf_counter() - started, False)
+        return row
+
+    def close(self):
+        if self._statement is not None:
+            self._finish_statement()
+        super().close()
+
+    def __del__(self):
+        if self._statement is not None:
+            self._finish_statement()
+
+    def _fetched(self, rows, seconds, done):
+        query_counts = counts()
+        query_counts.rows += rows
+        query_counts.seconds += seconds
+        if self._statement is not None:
+            self._statement_rows += rows
+            self._statement_seconds += seconds
+            if done:
+                self._finish_statement()
+
+    def _start_statement(self, sql, parameters, seconds):
+        self._statement = (sql, parameters)
+        self._statement_seconds = seconds
+        self._statement_rows = 0
+        # Statements without a result set are finished already
+        if self.description is None:
+            self._finish_statement()
+
+    def _finish_statement(self):
+        sql, parameters = self._statement
+        self._statement = None
+        log = slow_query_log
+        if log is not None and self._statement_seconds * 1000 >= log.threshold_ms:
+            log.record(self.connection, sql, parameters, self._statement_seconds, self._statement_rows)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the implicit ones, are instrumented"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute() would otherwise create a plain cursor in C
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
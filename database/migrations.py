@@ -0,0 +1,97 @@
+import sqlite3
+
+from . import aggregates, search
+from .connection import get_connection
+
+
+# Schema changes applied in order. The number of the last one applied is
+# kept in the database's user_version, so each runs exactly once. Never
+# edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    (1, "Index the foreign keys used by book, review and category lookups", """
+        CREATE INDEX IF NOT EXISTS Review_book_id ON Review (book_id);
+        CREATE INDEX IF NOT EXISTS Review_user_id ON Review (user_id);
+        CREATE INDEX IF NOT EXISTS BookCategory_category_id ON BookCategory (category_id);
+    """),
+    (2, "Allow each category at most once per book", """
+        DELETE FROM BookCategory
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM BookCategory GROUP BY book_id, category_id
+        );
+        -- Also serves as the BookCategory.book_id index
+        CREATE UNIQUE INDEX IF NOT EXISTS BookCategory_book_id_category_id
+            ON BookCategory (book_id, category_id);
+    """),
+    (3, "Keep per-book rating stats in BookStats", aggregates.BOOK_STATS_SCHEMA + f"""
+        DELETE FROM BookStats;
+        INSERT INTO BookStats {aggregates.COMPUTE_BOOK_STATS};
+    """),
+    (4, "Full-text search over book titles, authors and review text",
+        search.SEARCH_SCHEMA + search.REBUILD_SEARCH),
+    (5, "List the books of a category in id order and keep per-category book counts", """
+        -- Walks a category's books in book_id order without touching the table
+        CREATE INDEX IF NOT EXISTS BookCategory_category_id_book_id
+            ON BookCategory (category_id, book_id);
+        DROP INDEX IF EXISTS BookCategory_category_id;
+    """ + aggregates.CATEGORY_STATS_SCHEMA + f"""
+        DELETE FROM CategoryStats;
+        INSERT INTO CategoryStats {aggregates.COMPUTE_CATEGORY_STATS};
+    """),
+    (6, "Rank books by a Bayesian average rating", aggregates.BOOK_SCORE_SCHEMA),
+    (7, "List a user's books and keep per-user review counts", """
+        -- Every SQLite index ends with the rowid, so this is an index on
+        -- (user_id, id), like Review_user_id is for reviews
+        CREATE INDEX IF NOT EXISTS Book_user_id ON Book (user_id);
+    """ + aggregates.USER_STATS_SCHEMA + f"""
+        DELETE FROM UserStats;
+        INSERT INTO UserStats {aggregates.COMPUTE_USER_STATS};
+    """),
+]
+
+
+def current_version():
+    """Number of the last migration applied to the database"""
+    with get_connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    """Apply every pending migration; returns the versions applied
+
+    Each migration runs in its own IMMEDIATE transaction together with the
+    version bump, so a failure leaves the database at the previous version
+    and two servers starting at once cannot apply the same migration twice.
+    """
+    applied = []
+    conn = get_connection()
+
+    for version, description, script in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            for statement in _split_statements(script):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((version, description))
+
+    return applied
+
+
+def _split_statements(script):
+    """Split a SQL script into single statements, keeping triggers whole"""
+    statements = []
+    pending = ""
+    for line in script.splitlines(keepends=True):
+        pending += line
+        if sqlite3.complete_statement(pending):
+            statements.append(pending.strip())
+            pending = ""
+    if pending.strip():
+        statements.append(pending.strip())
+    return statements
@@ -0,0 +1,100 @@
+import sqlite3
+
+from .connection import get_connection
+
+
+# The per-request queries that must be answered from an index. Each entry
+# is (name, sql, sample parameters, tables that must not be scanned).
+HOT_QUERIES = [
+    ("book categories", """
+        SELECT bc.book_id, c.id, c.category_name
+        FROM BookCategory bc
+        JOIN Category c ON c.id = bc.category_id
+        WHERE bc.book_id IN (?, ?)
+        ORDER BY bc.id
+    """, (1, 2), ("bc",)),
+    ("book reviews", """
+        SELECT r.book_id, r.id, r.rating, r.review_text, r.user_id, u.username
+        FROM Review r
+        JOIN User u ON r.user_id = u.id
+        WHERE r.book_id IN (?, ?)
+        ORDER BY r.id
+    """, (1, 2), ("r",)),
+    ("delete book categories", "DELETE FROM BookCategory WHERE book_id = ?", (1,), ("BookCategory",)),
+    ("delete book reviews", "DELETE FROM Review WHERE book_id = ?", (1,), ("Review",)),
+    ("reviews by user", "SELECT id FROM Review WHERE user_id = ?", (1,), ("Review",)),
+    ("books in category", "SELECT book_id FROM BookCategory WHERE category_id = ?", (1,), ("BookCategory",)),
+    ("books in all categories", """
+        SELECT bc.book_id
+        FROM BookCategory bc
+        WHERE bc.category_id = ? AND bc.book_id > ?
+        AND EXISTS (
+            SELECT 1 FROM BookCategory other
+            WHERE other.book_id = bc.book_id AND other.category_id = ?
+        )
+        ORDER BY bc.book_id
+        LIMIT ?
+    """, (1, 0, 2, 10), ("bc", "other")),
+    ("reviews by user page", """
+        SELECT r.id, r.rating, r.review_text, r.book_id, r.user_id, b.title
+        FROM Review r
+        JOIN Book b ON r.book_id = b.id
+        WHERE r.user_id = ? AND r.id > ?
+        ORDER BY r.id
+        LIMIT ?
+    """, (1, 0, 10), ("r", "b")),
+    ("books by user page", """
+        SELECT b.id FROM Book b
+        WHERE b.user_id = ? AND b.id > ?
+        ORDER BY b.id
+        LIMIT ?
+    """, (1, 0, 10), ("b",)),
+    ("top rated books", """
+        SELECT book_id, score
+        FROM BookStats
+        WHERE review_count >= ?
+        ORDER BY score DESC, review_count DESC, book_id
+        LIMIT ?
+    """, (1, 10), ("BookStats",)),
+]
+
+# Hot queries allowed to sort in a temporary B-tree. They sort the
+# categories or reviews of one page of books, which is a few rows; every
+# other hot query must read its rows in ORDER BY order from an index.
+SORTS_ALLOWED = {"book categories", "book reviews"}
+
+
+def explain(sql, params=(), conn=None):
+    """EXPLAIN QUERY PLAN output for a statement, one detail string per step
+
+    Uses the calling thread's connection unless `conn` is given. The plan
+    is read through a plain cursor, so it does not show up in the
+    instrumentation counts, and no transaction is committed.
+    """
+    if conn is None:
+        conn = get_connection()
+    rows = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row["detail"] for row in rows]
+
+
+def find_table_scans():
+    """Check HOT_QUERIES against the current schema
+
+    Returns (name, plan) pairs for every hot query whose plan does a full
+    scan of a table it should reach through an index, or sorts its rows
+    in a temporary B-tree (unless listed in SORTS_ALLOWED).
+    """
+    problems = []
+    for name, sql, params, tables in HOT_QUERIES:
+        plan = explain(sql, params)
+        for detail in plan:
+            scanned = detail.split()[1] if detail.startswith("SCAN ") else None
+            # Walking an index in ORDER BY order stops at the LIMIT
+            if scanned in tables and " INDEX " not in detail:
+                problems.append((name, plan))
+                break
+            # A sort reads every matching row before the LIMIT applies
+            if detail.startswith("USE TEMP B-TREE FOR") and "ORDER BY" in detail and name not in SORTS_ALLOWED:
+                problems.append((name, plan))
+                break
+    return problems
@@ -0,0 +1,253 @@
+import os
+import sqlite3
+import threading
+from time import monotonic, sleep
+
+from . import connection
+from .connection import get_connection
+from .instrument import InstrumentedConnection
+
+
+class ReadReplica:
+    """An in-memory copy of the database for read-only queries
+
+    Each snapshot is a shared-cache memory database filled from the disk
+    database with the backup API. A refresher thread takes a new snapshot
+    whenever it learns of a write, either through notify_write() or by
+    seeing PRAGMA data_version change (writes from other processes), and
+    then swaps it in; threads move to the new snapshot on their next read.
+
+    Staleness is bounded: once a write is older than max_staleness_ms and
+    still not in the snapshot, connection() returns None and reads go to
+    disk until the refresh lands. Writes made by other processes are only
+    noticed after up to poll_ms, which adds to their bound.
+    """
+
+    def __init__(self, max_staleness_ms=1000, poll_ms=100):
+        self.max_staleness = max_staleness_ms / 1000
+        self.poll = poll_ms / 1000
+        self.refresh_interval = self.max_staleness / 4
+        # Called after each swap, e.g. to clear a response cache that may
+        # hold bodies built from the old snapshot
+        self.on_swap = []
+
+        self.generation = 0
+        self.refreshes = 0
+        self.stale_reads = 0
+        self.last_refresh_seconds = None
+        self.bytes = 0
+        self._keeper = None
+        self._uri = None
+        self._refreshed_at = None
+        self._dirty_since = None
+        self._seen_version = None
+        self._pid = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+        # Every open snapshot connection: {"generation": ..., "busy": ...}
+        self._connections = {}
+
+    def connection(self):
+        """The calling thread's connection to the current snapshot
+
+        Returns None when the snapshot is too stale to use. The connection
+        counts as busy until release() is called on the same thread.
+        """
+        if self._pid != os.getpid():
+            self._start()
+
+        dirty_since = self._dirty_since
+        if dirty_since is not None and monotonic() - dirty_since > self.max_staleness:
+            self.stale_reads += 1
+            return None
+
+        with self._lock:
+            conn = getattr(self._local, "connection", None)
+            entry = self._connections.get(conn)
+            # A request keeps reading the snapshot it started on
+            if entry is not None and (entry["generation"] == self.generation or entry["busy"]):
+                entry["busy"] = True
+                return conn
+            # Still registered means this thread owns the old connection
+            stale = self._connections.pop(conn, None) is not None
+            uri = self._uri
+            generation = self.generation
+        if stale:
+            conn.close()
+
+        conn = self._open(uri)
+        with self._lock:
+            self._connections[conn] = {"generation": generation, "busy": True}
+        self._local.connection = conn
+        return conn
+
+    def release(self):
+        """Mark the calling thread's connection idle, closing it if it is old"""
+        conn = getattr(self._local, "connection", None)
+        with self._lock:
+            entry = self._connections.get(conn)
+            if entry is None:
+                return
+            if entry["generation"] == self.generation:
+                entry["busy"] = False
+                return
+            del self._connections[conn]
+        conn.close()
+
+    def notify_write(self):
+        """Tell the replica the disk database just changed"""
+        now = monotonic()
+        with self._lock:
+            if self._dirty_since is None:
+                self._dirty_since = now
+        self._wake.set()
+
+    def refresh(self):
+        """Copy the disk database into a new snapshot and swap it in"""
+        started = monotonic()
+        generation = self.generation + 1
+        uri = f"file:janesreviews-replica-{os.getpid()}-{generation}?mode=memory&cache=shared"
+
+        self._seen_version = connection.data_version()
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        # One step, so the copy is a single consistent read of the database
+        get_connection().backup(keeper)
+        page_count = keeper.execute("PRAGMA page_count").fetchone()[0]
+        page_size = keeper.execute("PRAGMA page_size").fetchone()[0]
+
+        with self._lock:
+            old_keeper = self._keeper
+            self._keeper = keeper
+            self._uri = uri
+            self.generation = generation
+            self.bytes = page_count * page_size
+            self._refreshed_at = monotonic()
+            # Writes noticed after the copy started may be missing from it
+            if self._dirty_since is not None and self._dirty_since >= started:
+                self._dirty_since = started
+            else:
+                self._dirty_since = None
+            # Idle threads would otherwise keep old snapshots in memory;
+            # busy ones close theirs in release()
+            idle = [conn for conn, entry in self._connections.items() if not entry["busy"]]
+            for conn in idle:
+                del self._connections[conn]
+        self.refreshes += 1
+        self.last_refresh_seconds = monotonic() - started
+
+        # A snapshot is freed when its last connection closes
+        for conn in idle:
+            conn.close()
+        if old_keeper is not None:
+            old_keeper.close()
+        for callback in self.on_swap:
+            callback()
+
+    def stats(self):
+        """Snapshot size and refresh counters"""
+        refreshed_at = self._refreshed_at
+        return {
+            "generation": self.generation,
+            "bytes": self.bytes,
+            "connections": len(self._connections),
+            "refreshes": self.refreshes,
+            "stale_reads": self.stale_reads,
+            "last_refresh_seconds": self.last_refresh_seconds,
+            "age_seconds": None if refreshed_at is None else monotonic() - refreshed_at,
+        }
+
+    def _start(self):
+        # Snapshots and the refresher thread do not survive fork(), so each
+        # process builds its own on first use
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            with self._lock:
+                self._keeper = None
+                self._dirty_since = None
+                self._connections = {}
+                self._local = threading.local()
+            self.refresh()
+            self._thread = threading.Thread(target=self._run, name="read-replica", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            version = connection.data_version()
+            if version != self._seen_version:
+                self._seen_version = version
+                # The write happened at most one poll ago
+                with self._lock:
+                    if self._dirty_since is None:
+                        self._dirty_since = monotonic() - self.poll
+            if self._dirty_since is not None:
+                # Under a stream of writes, take at most one snapshot per
+                # refresh_interval; reads go to disk if that is too slow
+                pause = self._refreshed_at + self.refresh_interval - monotonic()
+                if pause > 0:
+                    sleep(pause)
+                try:
+                    self.refresh()
+                except sqlite3.Error:
+                    # Reads fall back to disk once the replica is too stale;
+                    # try again on the next poll
+                    pass
+
+    def _open(self, uri):
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            isolation_level=None,
+            factory=InstrumentedConnection if connection.settings["instrument"] else sqlite3.Connection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+
+# The replica get_read_connection() uses, None while the mode is off
+_replica = None
+
+
+def enable(max_staleness_ms=1000, poll_ms=100):
+    """Serve get_read_connection() from an in-memory replica from now on"""
+    global _replica
+    _replica = ReadReplica(max_staleness_ms, poll_ms)
+    return _replica
+
+
+def disable():
+    global _replica
+    _replica = None
+
+
+def notify_write():
+    """Tell the replica, if there is one, that the disk database changed"""
+    if _replica is not None:
+        _replica.notify_write()
+
+
+def release():
+    """Called when a request ends, so old snapshots can be freed"""
+    if _replica is not None:
+        _replica.release()
+
+
+def get_read_connection():
+    """Connection for queries that only read
+
+    The replica's connection when the replica is on and fresh enough,
+    otherwise the calling thread's disk connection.
+    """
+    if _replica is not None:
+        conn = _replica.connection()
+        if conn is not None:
+            return conn
+    return get_connection()
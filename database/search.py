@@ -0,0 +1,87 @@
+import re
+
+from .connection import get_connection
+
+
+# bm25 scores are only computed for this many of the newest matches. Words
+# that appear in most rows would otherwise score every row on each search;
+# queries with fewer matches than this are ranked exactly.
+MAX_RANKED_MATCHES = 5000
+
+# External-content FTS5 indexes over the searchable text columns. The
+# triggers keep them in step with every insert, update and delete.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS BookSearch USING fts5(
+    title, author, content='Book', content_rowid='id'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS ReviewSearch USING fts5(
+    review_text, content='Review', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS BookSearch_after_book_insert
+AFTER INSERT ON Book
+BEGIN
+    INSERT INTO BookSearch (rowid, title, author) VALUES (NEW.id, NEW.title, NEW.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS BookSearch_after_book_delete
+AFTER DELETE ON Book
+BEGIN
+    INSERT INTO BookSearch (BookSearch, rowid, title, author) VALUES ('delete', OLD.id, OLD.title, OLD.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS BookSearch_after_book_update
+AFTER UPDATE OF title, author ON Book
+BEGIN
+    INSERT INTO BookSearch (BookSearch, rowid, title, author) VALUES ('delete', OLD.id, OLD.title, OLD.author);
+    INSERT INTO BookSearch (rowid, title, author) VALUES (NEW.id, NEW.title, NEW.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ReviewSearch_after_review_insert
+AFTER INSERT ON Review
+BEGIN
+    INSERT INTO ReviewSearch (rowid, review_text) VALUES (NEW.id, NEW.review_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ReviewSearch_after_review_delete
+AFTER DELETE ON Review
+BEGIN
+    INSERT INTO ReviewSearch (ReviewSearch, rowid, review_text) VALUES ('delete', OLD.id, OLD.review_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ReviewSearch_after_review_update
+AFTER UPDATE OF review_text ON Review
+BEGIN
+    INSERT INTO ReviewSearch (ReviewSearch, rowid, review_text) VALUES ('delete', OLD.id, OLD.review_text);
+    INSERT INTO ReviewSearch (rowid, review_text) VALUES (NEW.id, NEW.review_text);
+END;
+"""
+
+REBUILD_SEARCH = """
+INSERT INTO BookSearch (BookSearch) VALUES ('rebuild');
+INSERT INTO ReviewSearch (ReviewSearch) VALUES ('rebuild');
+"""
+
+
+def rebuild_search_indexes():
+    """Rebuild both search indexes from the Book and Review tables"""
+    with get_connection() as conn:
+        conn.execute("INSERT INTO BookSearch (BookSearch) VALUES ('rebuild')")
+        conn.execute("INSERT INTO ReviewSearch (ReviewSearch) VALUES ('rebuild')")
+        # Merge the index b-trees so queries touch fewer pages
+        conn.execute("INSERT INTO BookSearch (BookSearch) VALUES ('optimize')")
+        conn.execute("INSERT INTO ReviewSearch (ReviewSearch) VALUES ('optimize')")
+
+
+def match_expression(text):
+    """Turn free text typed by a user into a safe FTS5 MATCH expression
+
+    Every word is quoted, so FTS5 operators and punctuation in the input
+    cannot cause syntax errors, and the words are ANDed together. Returns
+    None when the text has no searchable words.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join('"' + word + '"' for word in words)
@@ -0,0 +1,174 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from . import instrument, plans
+
+
+DEFAULT_LOG_PATH = "slow-queries.log"
+
+
+class SlowQueryLog:
+    """Writes statements slower than threshold_ms as JSON lines
+
+    A statement's time runs from execute() until its last row is fetched,
+    so a query that is cheap to start but slow to step through is caught
+    too. Each line holds the statement, its parameters with the values
+    replaced by their types, the duration, the rows fetched, the calling
+    function and the EXPLAIN QUERY PLAN output.
+    """
+
+    def __init__(self, path, threshold_ms):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+        if path == "-":
+            self._file = sys.stderr
+        else:
+            self._file = open(path, "a", buffering=1)
+
+    def record(self, conn, sql, params, seconds, rows):
+        entry = {
+            "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "pid": os.getpid(),
+            "duration_ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "statement": " ".join(sql.split()),
+            "params": redact(params),
+            "caller": calling_function(),
+            "plan": explain(conn, sql, params),
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        if self._file is not sys.stderr:
+            self._file.close()
+
+
+def enable(path, threshold_ms):
+    """Start logging statements that take threshold_ms or longer
+
+    Only instrumented connections are watched, so this needs the database
+    "instrument" setting on (the default).
+    """
+    disable()
+    instrument.slow_query_log = SlowQueryLog(path, threshold_ms)
+
+
+def disable():
+    if instrument.slow_query_log is not None:
+        instrument.slow_query_log.close()
+        instrument.slow_query_log = None
+
+
+def redact(params):
+    """Parameters with every value replaced by its type, e.g. "<str>" """
+    if params is None:
+        # executemany(), whose parameter sets are not kept
+        return None
+    if isinstance(params, dict):
+        return {name: f"<{type(value).__name__}>" for name, value in params.items()}
+    return [f"<{type(value).__name__}>" for value in params]
+
+
+def calling_function():
+    """Module and name of the first function outside the database package"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module != "database" and not module.startswith("database."):
+            return f"{module}.{function_name(frame)}"
+        frame = frame.f_back
+    return None
+
+
+def function_name(frame):
+    """Qualified name of the function running in frame, e.g. "Books.get_all"
+
+    code.co_qualname only exists from Python 3.11; before that the class
+    is taken from the method's self argument, when it has one.
+    """
+    code = frame.f_code
+    qualname = getattr(code, "co_qualname", None)
+    if qualname is not None:
+        return qualname
+    if code.co_varnames[:1] == ("self",) and "self" in frame.f_locals:
+        return f"{type(frame.f_locals['self']).__name__}.{code.co_name}"
+    return code.co_name
+
+
+def explain(conn, sql, params):
+    """Query plan of a logged statement, or the reason there is none"""
+    if params is None:
+        # Any values will do for the plan of an executemany() statement
+        params = (None,) * sql.count("?")
+    try:
+        return plans.explain(sql, params, conn)
+    except sqlite3.Error as error:
+        return [f"EXPLAIN failed: {error}"]
+
+
+def normalize(statement):
+    """Statement text with literals and IN lists folded, for grouping"""
+    statement = " ".join(statement.split())
+    statement = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = re.sub(r"\b\d+(\.\d+)?\b", "?", statement)
+    # IN (?, ?, ?) with any number of ids is the same query
+    statement = re.sub(r"\(\s*\?(\s*,\s*\?)*\s*\)", "(?...)", statement)
+    return statement
+
+
+def report(lines):
+    """Aggregate slow-query log lines by normalized statement
+
+    Returns one dictionary per statement, the one with the most total time
+    first.
+    """
+    groups = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        key = normalize(entry["statement"])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "statement": key,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "callers": set(),
+                "plan": entry["plan"],
+                "durations": [],
+            }
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+        group["rows"] += entry["rows"]
+        if entry["caller"]:
+            group["callers"].add(entry["caller"])
+        group["durations"].append(entry["duration_ms"])
+        # Keep the newest plan, it reflects the current schema
+        group["plan"] = entry["plan"]
+
+    results = []
+    for group in groups.values():
+        durations = sorted(group.pop("durations"))
+        group["mean_ms"] = group["total_ms"] / group["count"]
+        group["p95_ms"] = durations[max(0, round(0.95 * len(durations)) - 1)]
+        group["callers"] = sorted(group["callers"])
+        # Full scans, leaving out FTS lookups and subquery results
+        group["scans"] = [
+            detail for detail in group["plan"]
+            if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail and "subquery" not in detail
+        ]
+        results.append(group)
+    results.sort(key=lambda group: group["total_ms"], reverse=True)
+    return results
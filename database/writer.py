@@ -0,0 +1,151 @@
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, TimeoutError
+from time import monotonic
+
+from .bulk import ROW_ERRORS
+from .connection import get_connection
+
+
+class GroupCommitWriter:
+    """One thread that commits inserts from many callers together
+
+    Inserts that arrive within window_ms of the first one in a batch (up
+    to max_batch of them) go into a single IMMEDIATE transaction, so a
+    burst of writers pays for one commit and one round of lock handoff
+    instead of one each. Every insert runs in its own savepoint: a row
+    that violates a constraint is rolled back alone and its caller gets
+    the error, while the rest of the batch commits.
+
+    insert() returns only after the batch's COMMIT, so a row is exactly
+    as durable as with a commit of its own. A caller waits at most
+    timeout_ms for its batch to start; after that its row is withdrawn
+    and it gets a "database is busy" error, which the server answers with
+    a 503.
+    """
+
+    def __init__(self, window_ms=2, max_batch=256, timeout_ms=10000):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.timeout = timeout_ms / 1000
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def insert(self, sql, params):
+        """Run one INSERT through the writer; returns the new row's id
+
+        Raises whatever error the statement or the commit raised.
+        """
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((sql, params, future))
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # Withdraw the row if its batch has not started. A batch that
+            # has started finishes within SQLite's busy timeout.
+            if future.cancel():
+                raise sqlite3.OperationalError("database is busy: the group commit writer did not get to this row in time")
+            return future.result()
+
+    def _ensure_thread(self):
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            return
+        with self._lock:
+            # The thread does not survive fork(), so each process starts its
+            # own with a queue of its own
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._thread = None
+                self._pid = os.getpid()
+            # A thread that died is replaced; rows it left queued are kept
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="group-commit-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self, work):
+        while True:
+            batch = [work.get()]
+            try:
+                deadline = monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - monotonic()
+                    try:
+                        batch.append(work.get(timeout=remaining) if remaining > 0 else work.get_nowait())
+                    except queue.Empty:
+                        break
+                # Rows whose callers gave up are left out
+                batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+                if batch:
+                    self._commit(batch)
+            except BaseException as error:
+                # Never leave a caller waiting on a row this thread dropped
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                if not isinstance(error, Exception):
+                    raise
+
+    def _commit(self, batch):
+        results = []
+        try:
+            conn = get_connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for sql, params, future in batch:
+                    conn.execute("SAVEPOINT group_row")
+                    try:
+                        results.append((future, conn.execute(sql, params).lastrowid, None))
+                    except ROW_ERRORS as error:
+                        conn.execute("ROLLBACK TO group_row")
+                        results.append((future, None, error))
+                    conn.execute("RELEASE group_row")
+        except Exception as error:
+            # Nothing was committed, so every caller gets the failure
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+
+        self.batches += 1
+        self.rows += len(batch)
+        for future, row_id, error in results:
+            if error is None:
+                future.set_result(row_id)
+            else:
+                future.set_exception(error)
+
+
+# The writer insert() hands rows to, None while group commit is off
+_writer = None
+
+
+def enable(window_ms=2, max_batch=256, timeout_ms=10000):
+    """Send insert() calls through a GroupCommitWriter from now on"""
+    global _writer
+    _writer = GroupCommitWriter(window_ms, max_batch, timeout_ms)
+    return _writer
+
+
+def disable():
+    global _writer
+    _writer = None
+
+
+def insert(sql, params):
+    """Insert one row and commit it; returns the new row's id
+
+    Goes through the group-commit writer when it is enabled, otherwise
+    commits on the calling thread's connection.
+    """
+    writer = _writer
+    if writer is not None:
+        return writer.insert(sql, params)
+    with get_connection() as conn:
+        return conn.execute(sql, params).lastrowid
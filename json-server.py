@@ -1,27 +1,78 @@
+import argparse
 import json
 from http.server import HTTPServer
 from nss_handler import HandleRequests, status
+from nss_server import PooledHTTPServer, serve_until_signalled, serve_prefork
+from response_cache import ResponseCache, make_etag, if_match_satisfied
+from metrics import cache_collector, replica_collector, admission_collector
+from admission import AdmissionControl
+import database
 
 
 # Add your imports below this line
-from views import Reviews, Books, Categories
+from views import Reviews, Books, Categories, Users, PreconditionFailed
+
+
+# Resources that each cached GET response is built from. A write to any of
+# them invalidates the cached response.
+CACHE_TAGS = {
+    "books": ("books", "reviews", "categories", "users"),
+    "reviews": ("reviews", "books"),
+    "categories": ("categories", "books", "reviews", "users"),
+    "users": ("users", "reviews", "books", "categories"),
+}
 
 
 class JSONServer(HandleRequests):
     """Server class to handle incoming HTTP requests for Jane's Reviews"""
 
+    # Routes reported separately in /metrics
+    metric_routes = frozenset({
+        "/books", "/books/{id}", "/books/{id}/stats", "/books/bulk", "/books/top",
+        "/reviews", "/reviews/{id}", "/reviews/bulk",
+        "/categories", "/categories/{id}",
+        "/users/{id}", "/users/{id}/reviews", "/users/{id}/books",
+        "/cache", "/metrics", "/replica", "/admission",
+    })
+
+    # In-memory copy of the database serving reads, see --read-replica
+    read_replica = None
+
     def do_GET(self):
         """Handle GET requests from a client"""
 
         response_body = ""
         url = self.parse_url(self.path)
 
+        if self.send_cached_response(CACHE_TAGS.get(url["requested_resource"])):
+            return
+
         if url["requested_resource"] == "reviews":
             reviews = Reviews()
-            if url["pk"] == 0:
-                # Get all reviews
-                response_body = reviews.get_all()
-                return self.response(response_body, status.HTTP_200_SUCCESS)
+            if url["pk"] == 0 and "ids" in url["query_params"]:
+                # Get several reviews by id
+                try:
+                    review_ids = self.parse_ids(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                return self.response(reviews.get_many(review_ids), status.HTTP_200_SUCCESS)
+            elif url["pk"] == 0:
+                # Get a page of reviews
+                try:
+                    limit, after = self.parse_page(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                if "q" in url["query_params"]:
+                    # Full-text search, ranked best match first
+                    response_body, next_cursor = reviews.search(url["query_params"]["q"][0], limit, after)
+                    if response_body is None:
+                        return self.response("q must contain a word to search for", status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                    return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+                if self.should_stream(limit):
+                    next_cursor, reviews_iter = reviews.iter_page(limit, after)
+                    return self.stream_response(reviews_iter, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+                response_body, next_cursor = reviews.get_all(limit, after)
+                return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
             else:
                 # Get single review
                 response_body = reviews.get_single(url["pk"])
@@ -30,11 +81,61 @@ class JSONServer(HandleRequests):
                 else:
                     return self.response("Review not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
         elif url["requested_resource"] == "books":
-            books = Books()
-            if url["pk"] == 0:
-                # Get all books
-                response_body = books.get_all()
+            include = self.list_param(url["query_params"], "include")
+            if url["sub_resource"] == "top" and include is None:
+                # The leaderboard embeds nothing unless asked to
+                include = []
+            try:
+                books = Books(self.list_param(url["query_params"], "fields"), include)
+            except ValueError as error:
+                return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+            if url["sub_resource"] == "top":
+                # Best rated books, overall or in one category
+                try:
+                    limit, category_id, min_reviews = self.parse_top(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                response_body = books.get_top(limit, category_id, min_reviews)
                 return self.response(response_body, status.HTTP_200_SUCCESS)
+            elif url["pk"] == 0 and "ids" in url["query_params"]:
+                # Get several books by id
+                try:
+                    book_ids = self.parse_ids(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                return self.response(books.get_many(book_ids), status.HTTP_200_SUCCESS)
+            elif url["pk"] == 0:
+                # Get a page of books
+                try:
+                    limit, after = self.parse_page(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                if "q" in url["query_params"]:
+                    # Full-text search, ranked best match first
+                    response_body, next_cursor = books.search(url["query_params"]["q"][0], limit, after)
+                    if response_body is None:
+                        return self.response("q must contain a word to search for", status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                    return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+                if "category" in url["query_params"]:
+                    # Books filed under any (or all) of the given categories
+                    try:
+                        category_ids, match = self.parse_category_filter(url["query_params"])
+                    except ValueError as error:
+                        return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                    response_body, next_cursor = books.get_in_categories(category_ids, match, limit, after)
+                    return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+                if self.should_stream(limit):
+                    next_cursor, books_iter = books.iter_page(limit, after)
+                    return self.stream_response(books_iter, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+                response_body, next_cursor = books.get_all(limit, after)
+                return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+            elif url["sub_resource"] == "stats":
+                # Get the precomputed rating stats for a book
+                response_body = books.get_stats(url["pk"])
+                if response_body is not None:
+                    return self.response(response_body, status.HTTP_200_SUCCESS)
+                else:
+                    return self.response("Book not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
             else:
                 # Get single book
                 response_body = books.get_single(url["pk"])
@@ -46,13 +147,120 @@ class JSONServer(HandleRequests):
             categories = Categories()
             if url["pk"] == 0:
                 # Get all categories
-                response_body = categories.get_all()
+                include = self.list_param(url["query_params"], "include") or []
+                unknown = [name for name in include if name != "book_count"]
+                if unknown:
+                    return self.response("Unknown include: " + ", ".join(unknown), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                response_body = categories.get_all("book_count" in include)
                 return self.response(response_body, status.HTTP_200_SUCCESS)
             else:
-                return self.response("Individual category retrieval not implemented", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+                # Get a single category with a page of its books
+                try:
+                    books = Books(self.list_param(url["query_params"], "fields"), self.list_param(url["query_params"], "include"))
+                    limit, after = self.parse_page(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                response_body, next_cursor = categories.get_single(url["pk"], books, limit, after)
+                if response_body is not None:
+                    return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+                else:
+                    return self.response("Category not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+        elif url["requested_resource"] == "users" and url["pk"] != 0:
+            users = Users()
+            if url["sub_resource"] == "reviews":
+                # Get a page of the reviews a user wrote
+                try:
+                    limit, after = self.parse_page(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                response_body, next_cursor = users.get_reviews(url["pk"], limit, after)
+            elif url["sub_resource"] == "books":
+                # Get a page of the books a user added
+                try:
+                    books = Books(self.list_param(url["query_params"], "fields"), self.list_param(url["query_params"], "include"))
+                    limit, after = self.parse_page(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                response_body, next_cursor = users.get_books(url["pk"], books, limit, after)
+            elif url["sub_resource"] is None:
+                # Get a user's profile
+                response_body = users.get_single(url["pk"])
+                if response_body is not None:
+                    return self.response(response_body, status.HTTP_200_SUCCESS)
+                else:
+                    return self.response("User not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+            else:
+                return self.response("", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+            if response_body is not None:
+                return self.response(response_body, status.HTTP_200_SUCCESS, self.page_headers(limit, next_cursor))
+            else:
+                return self.response("User not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+        elif url["requested_resource"] == "metrics" and self.metrics is not None:
+            # Prometheus text format
+            response_body = self.metrics.render()
+            return self.response(response_body, status.HTTP_200_SUCCESS,
+                                 {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+        elif url["requested_resource"] == "replica" and self.read_replica is not None:
+            # Size and freshness of the in-memory copy
+            response_body = json.dumps(self.read_replica.stats())
+            return self.response(response_body, status.HTTP_200_SUCCESS)
+        elif url["requested_resource"] == "admission" and self.admission is not None:
+            # Concurrency limits, queues and rejections
+            response_body = json.dumps(self.admission.stats())
+            return self.response(response_body, status.HTTP_200_SUCCESS)
+        elif url["requested_resource"] == "cache" and self.response_cache is not None:
+            # Cache hit and miss counters
+            response_body = json.dumps(self.response_cache.stats())
+            return self.response(response_body, status.HTTP_200_SUCCESS)
         else:
             return self.response("", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
 
+    def parse_category_filter(self, query_params):
+        """Get the category ids and match mode from ?category=1,2&match=all
+
+        Raises ValueError with a message for the client when an id is not
+        a number or match is neither "any" nor "all".
+        """
+        try:
+            category_ids = [int(value) for value in self.list_param(query_params, "category")]
+        except ValueError:
+            raise ValueError("category must be whole numbers separated by commas")
+        if not category_ids:
+            raise ValueError("category must list at least one id")
+        if len(category_ids) > self.max_ids:
+            raise ValueError(f"category can list at most {self.max_ids} ids")
+
+        match = query_params.get("match", ["any"])[0]
+        if match not in ("any", "all"):
+            raise ValueError('match must be "any" or "all"')
+
+        return category_ids, match
+
+    def parse_top(self, query_params):
+        """Get (limit, category_id, min_reviews) for /books/top
+
+        The limit defaults to 10. Raises ValueError with a message for the
+        client when a value is not a usable number.
+        """
+        limit = 10
+        category_id = None
+        min_reviews = 1
+
+        if "limit" in query_params:
+            limit, _ = self.parse_page({"limit": query_params["limit"]})
+        if "category" in query_params:
+            try:
+                category_id = int(query_params["category"][0])
+            except ValueError:
+                raise ValueError("category must be a whole number")
+        if "min_reviews" in query_params:
+            try:
+                min_reviews = int(query_params["min_reviews"][0])
+            except ValueError:
+                raise ValueError("min_reviews must be a whole number")
+
+        return limit, category_id, min_reviews
+
     def do_PUT(self):
         """Handle PUT requests from a client"""
 
@@ -70,12 +278,52 @@ class JSONServer(HandleRequests):
                 books = Books()
                 updated = books.update(pk, request_body)
                 if updated:
+                    self.invalidate_cache("books")
                     return self.response(None, status.HTTP_204_SUCCESS_NO_RESPONSE_BODY)
                 else:
                     return self.response("Book not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
-        else:
-            return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
 
+        # Every request needs a response, or a keep-alive client would hang
+        return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+
+
+    def do_PATCH(self):
+        """Handle PATCH requests from a client"""
+
+        url = self.parse_url(self.path)
+        pk = url["pk"]
+
+        if url["requested_resource"] == "books" and pk != 0 and url["sub_resource"] is None:
+            content_len = int(self.headers.get('content-length', 0))
+            try:
+                request_body = json.loads(self.rfile.read(content_len))
+            except ValueError:
+                return self.response("The request body must be valid JSON", status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+
+            # With If-Match, only update the book the client last saw, as
+            # identified by the ETag of GET /books/{id}
+            precondition = None
+            if_match = self.headers.get("If-Match")
+            if if_match is not None:
+                def precondition(current_body):
+                    return if_match_satisfied(if_match, make_etag(current_body.encode()))
+
+            books = Books()
+            try:
+                response_body = books.patch(pk, request_body, precondition)
+            except PreconditionFailed:
+                return self.response("Book has changed since it was read, fetch it again and retry",
+                                     status.HTTP_412_CLIENT_ERROR_PRECONDITION_FAILED)
+            except ValueError as error:
+                return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+            if response_body is None:
+                return self.response("Book not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+
+            self.invalidate_cache("books")
+            return self.response(response_body, status.HTTP_200_SUCCESS, {"ETag": make_etag(response_body.encode())})
+
+        # Every request needs a response, or a keep-alive client would hang
+        return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
 
     def do_DELETE(self):
         """Handle DELETE requests from a client"""
@@ -88,46 +336,89 @@ class JSONServer(HandleRequests):
                 reviews = Reviews()
                 removed = reviews.delete(pk)
                 if removed:
+                    self.invalidate_cache("reviews")
                     return self.response(None, status.HTTP_204_SUCCESS_NO_RESPONSE_BODY)
                 else:
                     return self.response("Review not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
 
         elif url["requested_resource"] == "books":
+            if pk == 0 and "ids" in url["query_params"]:
+                # Delete several books in one transaction
+                try:
+                    book_ids = self.parse_ids(url["query_params"])
+                except ValueError as error:
+                    return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+                books = Books()
+                report = books.delete_many(book_ids)
+                self.invalidate_cache("books", "reviews")
+                return self.response(report, status.HTTP_200_SUCCESS)
             if pk != 0:
                 books = Books()
                 removed = books.delete(pk)
                 if removed:
+                    # Deleting a book also deletes its reviews
+                    self.invalidate_cache("books", "reviews")
                     return self.response(None, status.HTTP_204_SUCCESS_NO_RESPONSE_BODY)
                 else:
                     return self.response("Book not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
-        else:
-            return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+
+        # Every request needs a response, or a keep-alive client would hang
+        return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
 
     def do_POST(self):
         """Handle POST requests from a client"""
 
+        url = self.parse_url(self.path)
+
+        if url["sub_resource"] == "bulk":
+            return self.bulk_create(url)
+
         # Get the request body JSON for the new data
         content_len = int(self.headers.get('content-length', 0))
         request_body = self.rfile.read(content_len)
         request_body = json.loads(request_body)
 
-        url = self.parse_url(self.path)
-
         if url["requested_resource"] == "reviews":
             reviews = Reviews()
             new_review = reviews.create(request_body)
+            self.invalidate_cache("reviews")
             return self.response(new_review, status.HTTP_201_SUCCESS_CREATED)
         elif url["requested_resource"] == "books":
             books = Books()
             new_book = books.create(request_body)
+            self.invalidate_cache("books")
             return self.response(new_book, status.HTTP_201_SUCCESS_CREATED)
         elif url["requested_resource"] == "categories":
             categories = Categories()
             new_category = categories.create(request_body)
+            self.invalidate_cache("categories")
             return self.response(new_category, status.HTTP_201_SUCCESS_CREATED)
         else:
             return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
 
+    def bulk_create(self, url):
+        """Handle POST /books/bulk and POST /reviews/bulk"""
+
+        if url["requested_resource"] == "books":
+            view = Books()
+        elif url["requested_resource"] == "reviews":
+            view = Reviews()
+        else:
+            return self.response("Resource not found", status.HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND)
+
+        try:
+            rows = self.read_bulk_rows()
+        except ValueError as error:
+            return self.response(str(error), status.HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA)
+
+        # Rows are committed batch by batch, so invalidate even if a later
+        # batch fails
+        try:
+            report = view.bulk_create(rows)
+        finally:
+            self.invalidate_cache(url["requested_resource"])
+        return self.response(report, status.HTTP_200_SUCCESS)
+
 
 
 
@@ -135,9 +426,133 @@ class JSONServer(HandleRequests):
 # THE CODE BELOW THIS LINE IS NOT IMPORTANT FOR REACHING YOUR LEARNING OBJECTIVES
 #
 def main():
-    host = ''
-    port = 8000
-    HTTPServer((host, port), JSONServer).serve_forever()
+    parser = argparse.ArgumentParser(description="Jane's Reviews API server")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=8,
+                        help="worker threads serving connections, 0 for one request at a time")
+    parser.add_argument("--backlog", type=int, default=128,
+                        help="connections the OS queues while every worker is busy")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes sharing the listening socket (pre-fork mode when above 1)")
+    parser.add_argument("--max-page-size", type=int, default=HandleRequests.max_page_size,
+                        help="most rows a collection GET may return")
+    parser.add_argument("--max-ids", type=int, default=HandleRequests.max_ids,
+                        help="most ids a multi-get (?ids=1,2,3) may ask for")
+    parser.add_argument("--cache-mb", type=int, default=32,
+                        help="memory for cached GET responses, 0 turns the cache off")
+    parser.add_argument("--compress-min-bytes", type=int, default=HandleRequests.compression_min_size,
+                        help="compress response bodies at least this large, -1 turns compression off")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="turn off request timing, SQL counting and the /metrics endpoint")
+    parser.add_argument("--slow-query-ms", type=float,
+                        help="log SQL statements taking at least this many milliseconds")
+    parser.add_argument("--slow-query-log", default=database.slow_queries.DEFAULT_LOG_PATH,
+                        help="file the slow-query log is appended to, - for stderr")
+    parser.add_argument("--group-commit-ms", type=float,
+                        help="commit reviews created within this many milliseconds of each other together")
+    parser.add_argument("--group-commit-max", type=int, default=256,
+                        help="most reviews committed in one group")
+    parser.add_argument("--read-replica", action="store_true",
+                        help="serve reads from an in-memory copy of the database")
+    parser.add_argument("--replica-max-staleness-ms", type=float, default=1000,
+                        help="read from disk while the in-memory copy is missing a write older than this")
+    parser.add_argument("--route-concurrency", type=int,
+                        help="requests each route may run at once, e.g. GET /books")
+    parser.add_argument("--route-limit", action="append", default=[], metavar="'METHOD /route=N'",
+                        help="concurrency limit for one route, overriding --route-concurrency (repeatable)")
+    parser.add_argument("--max-reads", type=int,
+                        help="GET requests run at once; below --workers leaves workers free for writes")
+    parser.add_argument("--max-writes", type=int,
+                        help="POST, PUT and DELETE requests run at once")
+    parser.add_argument("--admission-queue", type=int, default=16,
+                        help="requests that may wait for each limit before the rest get a 503")
+    parser.add_argument("--admission-timeout-ms", type=float, default=1000,
+                        help="longest a request waits for its limits before getting a 503")
+    parser.add_argument("--rate-limit", type=float,
+                        help="requests per second allowed for each client address, above it clients get a 429")
+    parser.add_argument("--rate-burst", type=float,
+                        help="requests a client may make in a burst (default: the rate limit)")
+    parser.add_argument("--db", help="path of the SQLite database file")
+    args = parser.parse_args()
+
+    route_limits = {}
+    for option in args.route_limit:
+        route, _, limit = option.rpartition("=")
+        if not route or not limit.isdigit():
+            parser.error(f"--route-limit expects 'METHOD /route=N', got {option!r}")
+        route_limits[" ".join(route.split())] = int(limit)
+
+    HandleRequests.max_page_size = args.max_page_size
+    HandleRequests.max_ids = args.max_ids
+    HandleRequests.compression_min_size = args.compress_min_bytes if args.compress_min_bytes >= 0 else None
+    HandleRequests.default_page_size = min(HandleRequests.default_page_size, args.max_page_size)
+
+    if args.db:
+        database.configure(path=args.db)
+    if args.no_metrics:
+        HandleRequests.metrics = None
+        # The slow-query log needs the instrumented connections
+        database.configure(instrument=args.slow_query_ms is not None)
+    if args.slow_query_ms is not None:
+        database.slow_queries.enable(args.slow_query_log, args.slow_query_ms)
+    if args.group_commit_ms is not None:
+        database.writer.enable(args.group_commit_ms, args.group_commit_max)
+
+    # Bring the schema up to date before serving
+    database.migrations.migrate()
+
+    if args.cache_mb <= 0:
+        HandleRequests.response_cache = None
+    else:
+        # With several processes, writes made by the others are only
+        # noticed through the database's data_version counter
+        version_check = database.data_version if args.processes > 1 else None
+        HandleRequests.response_cache = ResponseCache(max_bytes=args.cache_mb * 1024 * 1024, version_check=version_check)
+        if HandleRequests.metrics is not None:
+            HandleRequests.metrics.collectors.append(cache_collector(HandleRequests.response_cache))
+
+    if args.read_replica:
+        # Each process builds its snapshot on its first read
+        read_replica = JSONServer.read_replica = database.replica.enable(args.replica_max_staleness_ms)
+        if HandleRequests.response_cache is not None:
+            # Bodies built from the old snapshot may be cached
+            read_replica.on_swap.append(HandleRequests.response_cache.clear)
+        if HandleRequests.metrics is not None:
+            HandleRequests.metrics.collectors.append(replica_collector(read_replica))
+
+    if route_limits or args.rate_limit is not None or any(
+            limit is not None for limit in (args.route_concurrency, args.max_reads, args.max_writes)):
+        HandleRequests.admission = AdmissionControl(
+            route_limit=args.route_concurrency,
+            read_limit=args.max_reads,
+            write_limit=args.max_writes,
+            route_limits=route_limits,
+            queue_size=args.admission_queue,
+            queue_timeout_ms=args.admission_timeout_ms,
+            rate=args.rate_limit,
+            burst=args.rate_burst,
+        )
+        if HandleRequests.metrics is not None:
+            HandleRequests.metrics.collectors.append(admission_collector(HandleRequests.admission))
+
+    host = args.host
+    port = args.port
+    if args.workers > 0:
+        server = PooledHTTPServer((host, port), JSONServer, workers=args.workers, backlog=args.backlog)
+    else:
+        server = HTTPServer((host, port), JSONServer)
+
+    if args.processes > 1:
+        # Workers must open their own connections after the fork
+        database.close_all()
+        serve_prefork(server, args.processes, on_worker_exit=database.close_all)
+        return
+
+    try:
+        serve_until_signalled(server)
+    finally:
+        database.close_all()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,179 @@
+import threading
+from bisect import bisect_left
+
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the SQL statements per request histogram buckets; a
+# route whose requests land in the high buckets is running a query per row
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+
+class Histogram:
+    """Counts of observed values per bucket, plus their sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last slot counts values above the largest bucket (le="+Inf")
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RouteMetrics:
+    """Everything recorded for one (method, route) pair"""
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statuses = {}
+        self.sql_rows = 0
+        self.sql_seconds = 0.0
+        self.write_seconds = 0.0
+        self.response_bytes = 0
+
+
+class Metrics:
+    """Per-route request metrics, rendered in the Prometheus text format
+
+    Each process keeps its own numbers, so in pre-fork mode /metrics shows
+    the process that answered the scrape.
+    """
+
+    def __init__(self, prefix="janesreviews"):
+        self.prefix = prefix
+        self._routes = {}
+        self._lock = threading.Lock()
+        # Functions returning extra (name, type, help, value) samples to
+        # render, e.g. the response cache counters. A fifth item, a dict of
+        # labels, lets one name have several samples.
+        self.collectors = []
+
+    def observe(self, method, route, code, seconds, statements, rows, sql_seconds, write_seconds, response_bytes):
+        """Record one finished request"""
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics()
+            metrics.duration.observe(seconds)
+            metrics.statements.observe(statements)
+            metrics.statuses[code] = metrics.statuses.get(code, 0) + 1
+            metrics.sql_rows += rows
+            metrics.sql_seconds += sql_seconds
+            metrics.write_seconds += write_seconds
+            metrics.response_bytes += response_bytes
+
+    def render(self):
+        """All metrics as Prometheus text exposition format"""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = []
+
+            self._header(lines, "requests_total", "counter", "Requests answered, by status code")
+            for (method, route), metrics in routes:
+                for code, count in sorted(metrics.statuses.items()):
+                    lines.append(f'{self.prefix}_requests_total{{method="{method}",route="{route}",code="{code}"}} {count}')
+
+            self._histogram(lines, routes, "request_duration_seconds", "duration",
+                            "Time from reading the request line to writing the last byte")
+            self._histogram(lines, routes, "sql_statements_per_request", "statements",
+                            "SQL statements run while handling a request")
+
+            counters = [
+                ("sql_rows_total", "sql_rows", "Rows fetched from SQLite"),
+                ("sql_seconds_total", "sql_seconds", "Time spent inside SQLite executing statements and stepping through rows"),
+                ("response_write_seconds_total", "write_seconds", "Time spent writing response bodies to the socket"),
+                ("response_bytes_total", "response_bytes", "Response body bytes written, after compression"),
+            ]
+            for name, attribute, help_text in counters:
+                self._header(lines, name, "counter", help_text)
+                for (method, route), metrics in routes:
+                    lines.append(f'{self.prefix}_{name}{{method="{method}",route="{route}"}} {getattr(metrics, attribute)}')
+
+        for collect in self.collectors:
+            samples = {}
+            for name, metric_type, help_text, value, *labels in collect():
+                if name not in samples:
+                    samples[name] = (metric_type, help_text, [])
+                samples[name][2].append((labels[0] if labels else {}, value))
+            # Samples of one metric must follow its header
+            for name, (metric_type, help_text, values) in samples.items():
+                self._header(lines, name, metric_type, help_text)
+                for labels, value in values:
+                    label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels.items())
+                    lines.append(f"{self.prefix}_{name}{{{label_text}}} {value}" if label_text else f"{self.prefix}_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, metric_type, help_text):
+        lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {self.prefix}_{name} {metric_type}")
+
+    def _histogram(self, lines, routes, name, attribute, help_text):
+        self._header(lines, name, "histogram", help_text)
+        for (method, route), metrics in routes:
+            histogram = getattr(metrics, attribute)
+            labels = f'method="{method}",route="{route}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'{self.prefix}_{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.prefix}_{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{self.prefix}_{name}_count{{{labels}}} {histogram.count}")
+
+
+def cache_collector(cache):
+    """Collector exposing a ResponseCache's counters"""
+    def collect():
+        stats = cache.stats()
+        return [
+            ("cache_hits_total", "counter", "Response cache hits", stats["hits"]),
+            ("cache_misses_total", "counter", "Response cache misses", stats["misses"]),
+            ("cache_evictions_total", "counter", "Responses evicted to stay within the cache size", stats["evictions"]),
+            ("cache_invalidations_total", "counter", "Cache invalidations caused by writes", stats["invalidations"]),
+            ("cache_entries", "gauge", "Responses currently cached", stats["entries"]),
+            ("cache_bytes", "gauge", "Bytes currently cached", stats["bytes"]),
+        ]
+    return collect
+
+
+def replica_collector(read_replica):
+    """Collector exposing a ReadReplica's size and refresh counters"""
+    def collect():
+        stats = read_replica.stats()
+        return [
+            ("replica_bytes", "gauge", "Size of the current in-memory snapshot", stats["bytes"]),
+            ("replica_connections", "gauge", "Open connections to in-memory snapshots", stats["connections"]),
+            ("replica_refreshes_total", "counter", "Snapshots taken", stats["refreshes"]),
+            ("replica_stale_reads_total", "counter", "Reads sent to disk because the snapshot was too stale", stats["stale_reads"]),
+            ("replica_last_refresh_seconds", "gauge", "Time the last snapshot took", stats["last_refresh_seconds"] or 0),
+        ]
+    return collect
+
+
+def admission_collector(admission):
+    """Collector exposing an AdmissionControl's limits and rejections"""
+    def collect():
+        stats = admission.stats()
+        samples = []
+        for limit in stats["limits"]:
+            labels = {"pool": limit["pool"]} if "pool" in limit else {"route": limit["route"]}
+            samples.extend([
+                ("admission_limit", "gauge", "Requests a pool or route may run at once", limit["limit"], labels),
+                ("admission_in_flight", "gauge", "Requests running in a pool or route", limit["in_flight"], labels),
+                ("admission_waiting", "gauge", "Requests queued for a pool or route", limit["waiting"], labels),
+                ("admission_admitted_total", "counter", "Requests admitted to a pool or route", limit["admitted"], labels),
+                ("admission_queue_full_total", "counter", "Requests rejected because the queue was full", limit["queue_full"], labels),
+                ("admission_timed_out_total", "counter", "Requests rejected after waiting too long in the queue", limit["timed_out"], labels),
+            ])
+        if "rate_limited" in stats:
+            samples.append(("rate_limited_total", "counter", "Requests rejected by the per-client rate limit", stats["rate_limited"]))
+            samples.append(("rate_limited_clients", "gauge", "Clients with a rate limit bucket", stats["rate_limited_clients"]))
+        return samples
+    return collect
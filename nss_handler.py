@@ -1,21 +1,463 @@
+import json
+import sqlite3
+import time
 from enum import Enum
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urlencode
 from http.server import BaseHTTPRequestHandler
+from response_cache import ResponseCache, make_etag, etag_matches
+from metrics import Metrics
+from database import instrument, replica
+import compression
+from admission import Rejected
 
 
 class status(Enum):
     HTTP_200_SUCCESS = 200
     HTTP_201_SUCCESS_CREATED = 201
     HTTP_204_SUCCESS_NO_RESPONSE_BODY = 204
+    HTTP_304_NOT_MODIFIED = 304
     HTTP_400_CLIENT_ERROR_BAD_REQUEST_DATA = 400
     HTTP_404_CLIENT_ERROR_RESOURCE_NOT_FOUND = 404
+    HTTP_412_CLIENT_ERROR_PRECONDITION_FAILED = 412
+    HTTP_429_CLIENT_ERROR_TOO_MANY_REQUESTS = 429
     HTTP_500_SERVER_ERROR = 500
+    HTTP_503_SERVICE_UNAVAILABLE = 503
+
+class RequestBody:
+    """The body of one request, read from the connection's input stream
+
+    Reads stop at the end of the body, so a handler can never read into
+    the next request on a kept-alive connection, and discard() skips what
+    the handler left unread.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.readline(size)
+        self.remaining -= len(data)
+        return data
+
+    def discard(self, max_bytes):
+        """Skip the unread rest of the body
+
+        Returns False when more than max_bytes are left, or the client
+        sent less than it announced; the connection cannot be reused then.
+        """
+        if self.remaining > max_bytes:
+            return False
+        while self.remaining > 0:
+            if not self.read(64 * 1024):
+                return False
+        return True
+
 
 class HandleRequests(BaseHTTPRequestHandler):
 
-    def response(self, body, code):
-        self.set_response_code(code.value)
-        self.wfile.write(body.encode())
+    # Keep connections open between requests (HTTP/1.1 keep-alive). Idle
+    # connections are dropped after `timeout` seconds to free their worker.
+    protocol_version = "HTTP/1.1"
+    timeout = 5
+    # Headers and body are separate writes; with Nagle's algorithm on, a
+    # kept-alive connection stalls on the client's delayed ACK between them
+    disable_nagle_algorithm = True
+
+    # A request body the handler did not read is skipped before the next
+    # request on the connection; bodies with more than this left unread
+    # close the connection instead
+    max_discard_size = 1024 * 1024
+
+    # Collection endpoints never return more than max_page_size rows, so a
+    # single request cannot dump a whole table
+    default_page_size = 100
+    max_page_size = 1000
+
+    # Most ids a multi-get (?ids=1,2,3) may ask for
+    max_ids = 100
+
+    # Pages with more rows than this are streamed with chunked transfer
+    # encoding instead of being built in memory (streamed pages are not cached)
+    streaming_threshold = 100
+    stream_chunk_size = 16 * 1024
+
+    # Bodies of at least compression_min_size bytes are gzip or deflate
+    # compressed when the client accepts it; None turns compression off
+    compression_min_size = 1024
+    compression_level = 6
+
+    # Serialized GET responses, set to None to turn caching off
+    response_cache = ResponseCache()
+    cache_tags = None
+
+    # Per-route timings and SQL counts, set to None to turn metrics off.
+    # Routes not listed in metric_routes are recorded as "other", so odd
+    # paths cannot create an unbounded number of series.
+    metrics = Metrics()
+    metric_routes = frozenset()
+
+    # Concurrency and rate limits applied before a request is handled, set
+    # to an admission.AdmissionControl to turn them on
+    admission = None
+
+    def setup(self):
+        super().setup()
+        # self.rfile is swapped for each request's RequestBody
+        self.connection_rfile = self.rfile
+
+    def handle_one_request(self):
+        """Answer 503 instead of dropping the request when SQLite stays locked"""
+        self.rfile = self.connection_rfile
+        self.cache_tags = None
+        self.request_started = None
+        self.admitted = None
+        try:
+            super().handle_one_request()
+        except sqlite3.OperationalError as error:
+            if "locked" not in str(error) and "busy" not in str(error):
+                raise
+            # Part of the request body may still be unread
+            self.close_connection = True
+            self.response("Database is busy, please retry", status.HTTP_503_SERVICE_UNAVAILABLE, {"Retry-After": "1"})
+        finally:
+            self.discard_unread_body()
+            if self.admitted is not None:
+                self.admission.release(self.admitted)
+            replica.release()
+            if self.request_started is not None and self.metrics is not None:
+                self.record_metrics()
+
+    def parse_request(self):
+        # Called once the request line is read, so idle keep-alive time is
+        # not counted
+        self.request_started = time.perf_counter()
+        self.response_code = None
+        self.write_seconds = 0.0
+        self.bytes_written = 0
+        instrument.reset()
+        if not super().parse_request():
+            return False
+        self.rfile = self.request_body()
+        return self.admit()
+
+    def request_body(self):
+        """The body of the request, as announced by its Content-Length"""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            # Chunked request bodies are not supported, so there is no
+            # telling where the next request starts
+            self.close_connection = True
+            return RequestBody(self.connection_rfile, 0)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.close_connection = True
+            length = 0
+        return RequestBody(self.connection_rfile, max(length, 0))
+
+    def discard_unread_body(self):
+        """Skip the part of the request body the handler did not read
+
+        Handlers that answer early (a 404, a rejected request) leave the
+        body in the socket, where it would be parsed as the next request.
+        """
+        body = self.rfile
+        self.rfile = self.connection_rfile
+        if not isinstance(body, RequestBody) or self.close_connection:
+            return
+        try:
+            if not body.discard(self.max_discard_size):
+                self.close_connection = True
+        except OSError:
+            self.close_connection = True
+
+    def admit(self):
+        """Wait for the admission limits; False once the request was rejected"""
+        if self.admission is None:
+            return True
+        try:
+            self.admitted = self.admission.admit(self.command, self.route_label(), self.client_address[0])
+        except Rejected as error:
+            # The request body, if any, is left unread
+            self.close_connection = True
+            self.response(str(error), status(error.code), {"Retry-After": str(error.retry_after)})
+            return False
+        return True
+
+    def send_response(self, code, message=None):
+        self.response_code = code
+        super().send_response(code, message)
+
+    def record_metrics(self):
+        """Add the request that just finished to the metrics"""
+        query_counts = instrument.counts()
+        self.metrics.observe(
+            self.command or "-",
+            self.route_label(),
+            # No status means the connection dropped before a response
+            self.response_code or "aborted",
+            time.perf_counter() - self.request_started,
+            query_counts.statements,
+            query_counts.rows,
+            query_counts.seconds,
+            self.write_seconds,
+            self.bytes_written,
+        )
+
+    def route_label(self):
+        """The request path with ids replaced, e.g. /books/{id}/stats"""
+        try:
+            url = self.parse_url(self.path)
+        except Exception:
+            return "other"
+        route = "/" + url["requested_resource"]
+        if url["pk"]:
+            route += "/{id}"
+        if url["sub_resource"]:
+            route += "/" + url["sub_resource"]
+        return route if route in self.metric_routes else "other"
+
+    def write_body(self, data):
+        """Write part of the response body, timing the socket write"""
+        started = time.perf_counter()
+        self.wfile.write(data)
+        self.write_seconds += time.perf_counter() - started
+        self.bytes_written += len(data)
+
+    def response(self, body, code, headers=None):
+        if body is None:
+            body = ""
+        encoded_body = body.encode()
+
+        # Successful GETs carry an ETag and are remembered by the cache
+        cache_entry = None
+        if self.command == "GET" and code is status.HTTP_200_SUCCESS:
+            headers = dict(headers or {})
+            headers["ETag"] = make_etag(encoded_body)
+            if self.cache_tags is not None:
+                cache_entry = self.response_cache.store(self.path, encoded_body, dict(headers), self.cache_tags, self.cache_snapshot)
+                headers["X-Cache"] = "MISS"
+
+        self.send_body(encoded_body, code, headers, cache_entry)
+
+    def send_body(self, encoded_body, code, headers=None, cache_entry=None):
+        """Write the response, or an empty 304 if the client's copy is current
+
+        The body is compressed when the client accepts it. When the body
+        came from (or went into) the response cache, `cache_entry` lets the
+        compressed copy be reused by later requests.
+        """
+        headers = dict(headers or {})
+        encoding = None
+        if self.compression_min_size is not None and code is not status.HTTP_204_SUCCESS_NO_RESPONSE_BODY \
+                and len(encoded_body) >= self.compression_min_size:
+            # The body depends on Accept-Encoding, whatever this client sent
+            headers["Vary"] = "Accept-Encoding"
+            encoding = compression.choose_encoding(self.headers.get("Accept-Encoding"))
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            # Each coding is a different representation, so it needs its own
+            # strong ETag
+            if "ETag" in headers:
+                headers["ETag"] = headers["ETag"][:-1] + "-" + encoding + '"'
+
+        if "ETag" in headers and etag_matches(self.headers.get("If-None-Match"), headers["ETag"]):
+            self.send_response(status.HTTP_304_NOT_MODIFIED.value)
+            self.send_header('ETag', headers["ETag"])
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_connection_header()
+            self.end_headers()
+            return
+
+        if encoding is not None:
+            if cache_entry is not None:
+                encoded_body = self.response_cache.variant(cache_entry, encoding, lambda: self.compress(encoded_body, encoding))
+            else:
+                encoded_body = self.compress(encoded_body, encoding)
+
+        self.set_response_code(code.value, len(encoded_body), headers)
+        self.write_body(encoded_body)
+
+    def compress(self, data, encoding):
+        return compression.compress(data, encoding, self.compression_level)
+
+    def read_bulk_rows(self):
+        """Get the rows of a bulk request body
+
+        The body is either a JSON array, or NDJSON (one JSON document per
+        line) when sent as application/x-ndjson. NDJSON is parsed line by
+        line while it is read from the socket; a line that is not valid JSON
+        comes through as None so the view can report it.
+
+        Raises ValueError when a JSON body is not an array.
+        """
+        content_len = int(self.headers.get('content-length', 0))
+        content_type = self.headers.get('Content-Type', '')
+
+        if "ndjson" in content_type or "jsonl" in content_type:
+            return self._read_ndjson_rows(content_len)
+
+        request_body = json.loads(self.rfile.read(content_len))
+        if not isinstance(request_body, list):
+            raise ValueError("Bulk requests need a JSON array or NDJSON body")
+        return request_body
+
+    def _read_ndjson_rows(self, content_len):
+        remaining = content_len
+        while remaining > 0:
+            line = self.rfile.readline(remaining)
+            if not line:
+                break
+            remaining -= len(line)
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+    def wants_ndjson(self):
+        """Check if the client asked for newline-delimited JSON"""
+        accept = self.headers.get("Accept", "")
+        return "application/x-ndjson" in accept or "application/jsonl" in accept
+
+    def should_stream(self, limit):
+        """Check if a collection page should go through stream_response()"""
+        return self.wants_ndjson() or limit > self.streaming_threshold
+
+    def stream_response(self, items, code, headers=None):
+        """Send an iterable of dictionaries while it is being produced
+
+        Items are encoded one at a time and written in chunks of about
+        stream_chunk_size bytes, so memory use does not grow with the
+        number of items. The body is a JSON array, or one JSON document per
+        line when the client accepts NDJSON.
+        """
+        ndjson = self.wants_ndjson()
+        # HTTP/1.0 clients do not understand chunked encoding, so they get
+        # a plain body ended by closing the connection
+        chunked = self.request_version == "HTTP/1.1"
+
+        # Streams are assumed to be large, so they are always compressed
+        # when the client accepts it
+        compressor = None
+        if self.compression_min_size is not None:
+            encoding = compression.choose_encoding(self.headers.get("Accept-Encoding"))
+            if encoding is not None:
+                compressor = compression.compressor(encoding, self.compression_level)
+
+        self.send_response(code.value)
+        if ndjson:
+            self.send_header('Content-type', 'application/x-ndjson')
+        else:
+            self.send_header('Content-type', 'application/json')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        if self.compression_min_size is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        if compressor is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if headers:
+            for name, value in headers.items():
+                self.send_header(name, value)
+        self.send_connection_header()
+        self.end_headers()
+
+        try:
+            pending = []
+            pending_size = 0
+            for piece in self._encode_stream(items, ndjson):
+                pending.append(piece)
+                pending_size += len(piece)
+                if pending_size >= self.stream_chunk_size:
+                    self._write_chunk("".join(pending).encode(), chunked, compressor)
+                    pending = []
+                    pending_size = 0
+            if pending:
+                self._write_chunk("".join(pending).encode(), chunked, compressor)
+            if compressor is not None:
+                self._write_chunk(compressor.flush(), chunked)
+            if chunked:
+                self.write_body(b"0\r\n\r\n")
+        except Exception as error:
+            # The status line is already sent, so the only way left to tell
+            # the client something went wrong is to cut the body short
+            self.log_error("Streaming response failed: %r", error)
+            self.close_connection = True
+
+    def _encode_stream(self, items, ndjson):
+        if ndjson:
+            for item in items:
+                yield json.dumps(item) + "\n"
+            return
+
+        # Same separators as json.dumps() uses for a list
+        yield "["
+        separator = ""
+        for item in items:
+            yield separator + json.dumps(item)
+            separator = ", "
+        yield "]"
+
+    def _write_chunk(self, data, chunked, compressor=None):
+        if compressor is not None:
+            data = compressor.compress(data)
+        # An empty chunk would end the body early
+        if not data:
+            return
+        if chunked:
+            self.write_body(b"%x\r\n" % len(data) + data + b"\r\n")
+        else:
+            self.write_body(data)
+
+    def send_cached_response(self, tags):
+        """Answer a GET from the response cache
+
+        `tags` names the resources the response is built from, or is None
+        when the route must not be cached. Returns True when the cached
+        response was sent. On a miss the tags are remembered so response()
+        can store the body the view builds.
+        """
+        self.cache_tags = None
+        if self.response_cache is None or tags is None:
+            return False
+        # The cache only holds JSON bodies, so NDJSON requests bypass it
+        if self.wants_ndjson():
+            return False
+
+        entry = self.response_cache.lookup(self.path)
+        if entry is None:
+            self.cache_tags = tags
+            self.cache_snapshot = self.response_cache.snapshot(tags)
+            return False
+
+        headers = dict(entry["headers"])
+        headers["X-Cache"] = "HIT"
+        self.send_body(entry["body"], status.HTTP_200_SUCCESS, headers, entry)
+        return True
+
+    def invalidate_cache(self, *tags):
+        """Forget cached responses built from the given resources
+
+        Called after every write, so it also tells the read replica (if
+        there is one) to take a new snapshot.
+        """
+        replica.notify_write()
+        if self.response_cache is not None:
+            self.response_cache.invalidate(*tags)
 
     def parse_url(self, path):
         """Parse the url into the resource and id"""
@@ -26,30 +468,126 @@ class HandleRequests(BaseHTTPRequestHandler):
         url_dictionary = {
             "requested_resource": resource,
             "query_params": {},
-            "pk": 0
+            "pk": 0,
+            "sub_resource": None
         }
 
         if parsed_url.query:
-            query = parse_qs(parsed_url.query)
+            query = parse_qs(parsed_url.query, keep_blank_values=True)
             url_dictionary["query_params"] = query
 
         try:
             pk = int(path_params[2])
             url_dictionary["pk"] = pk
-        except (IndexError, ValueError):
+        except ValueError:
+            # A name instead of an id, e.g. "bulk" in /books/bulk
+            if path_params[2]:
+                url_dictionary["sub_resource"] = path_params[2]
+        except IndexError:
             pass
 
+        # Anything after the id, e.g. "stats" in /books/3/stats
+        if len(path_params) > 3 and path_params[3]:
+            url_dictionary["sub_resource"] = path_params[3]
+
         return url_dictionary
 
-    def set_response_code(self, status):
+    def parse_page(self, query_params):
+        """Get the (limit, after) pair from the ?limit= and ?after= parameters
+
+        Raises ValueError with a message for the client when either value
+        is not a usable number.
+        """
+        limit = self.default_page_size
+        after = 0
+
+        if "limit" in query_params:
+            try:
+                limit = int(query_params["limit"][0])
+            except ValueError:
+                raise ValueError("limit must be a whole number")
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+            limit = min(limit, self.max_page_size)
+
+        if "after" in query_params:
+            try:
+                after = int(query_params["after"][0])
+            except ValueError:
+                raise ValueError("after must be a whole number")
+
+        return limit, after
+
+    def list_param(self, query_params, name):
+        """Get a comma separated query parameter as a list, or None if absent
+
+        ?fields=id,title and ?fields=id&fields=title both give ["id", "title"].
+        """
+        if name not in query_params:
+            return None
+        values = []
+        for value in query_params[name]:
+            values.extend(part.strip() for part in value.split(",") if part.strip())
+        return values
+
+    def parse_ids(self, query_params):
+        """Get the ids of a multi-get from ?ids=1,2,3
+
+        Raises ValueError with a message for the client when an id is not
+        a number, or when there are none or more than max_ids of them.
+        """
+        try:
+            ids = [int(value) for value in self.list_param(query_params, "ids")]
+        except ValueError:
+            raise ValueError("ids must be whole numbers separated by commas")
+        if not ids:
+            raise ValueError("ids must list at least one id")
+        if len(ids) > self.max_ids:
+            raise ValueError(f"ids can list at most {self.max_ids} ids")
+        return ids
+
+    def page_headers(self, limit, next_cursor):
+        """Headers pointing the client at the next page, if there is one"""
+        if next_cursor is None:
+            return {}
+
+        parsed_url = urlparse(self.path)
+        # Blank values are kept, so ?include= still embeds nothing on the
+        # next page
+        query = parse_qs(parsed_url.query, keep_blank_values=True)
+        query["limit"] = [str(limit)]
+        query["after"] = [str(next_cursor)]
+        next_url = f"{parsed_url.path}?{urlencode(query, doseq=True)}"
+
+        return {
+            "X-Next-Cursor": str(next_cursor),
+            "Link": f'<{next_url}>; rel="next"',
+        }
+
+    def set_response_code(self, status, content_length=0, headers=None):
+        headers = dict(headers or {})
         self.send_response(status)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', headers.pop('Content-Type', 'application/json'))
+        # 204 and 304 responses have no body, so they must not announce one
+        if status not in (204, 304):
+            self.send_header('Content-Length', str(content_length))
         self.send_header('Access-Control-Allow-Origin', '*')
+        if headers:
+            for name, value in headers.items():
+                self.send_header(name, value)
+        self.send_connection_header()
         self.end_headers()
 
+    def send_connection_header(self):
+        """Ask the client to close the connection while the server drains"""
+        if getattr(self.server, "draining", False):
+            self.send_header('Connection', 'close')
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE')
-        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, Accept')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE')
+        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, Accept, If-Match')
+        self.send_header('Content-Length', '0')
+        self.send_connection_header()
         self.end_headers()
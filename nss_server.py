@@ -0,0 +1,166 @@
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+
+# Pause before replacing a crashed worker so a crash loop cannot spin the CPU
+_RESPAWN_DELAY = 1
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a bounded pool of threads
+
+    At most `workers` connections are served at once. While every worker is
+    busy the server stops accepting, so new clients wait in the listen
+    backlog (`backlog` entries) instead of piling up in memory.
+    """
+
+    def __init__(self, server_address, handler_class, workers=8, backlog=128, bind_and_activate=True):
+        # socketserver reads request_queue_size when it calls listen()
+        self.request_queue_size = backlog
+        self.workers = workers
+        self.draining = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        self._free_workers = threading.Semaphore(workers)
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    def process_request(self, request, client_address):
+        """Hand the connection to a worker thread once one is free"""
+        self._free_workers.acquire()
+        self._executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free_workers.release()
+
+    def server_close(self):
+        """Stop listening, then wait for the in-flight requests to finish"""
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def serve_until_signalled(server):
+    """Serve requests until SIGINT or SIGTERM, then shut down gracefully
+
+    Keep-alive connections are told to close after their current request
+    and server_close() waits for the workers to finish before returning.
+    """
+    def request_shutdown(signum, frame):
+        server.draining = True
+        # shutdown() blocks until serve_forever() returns, so it cannot be
+        # called from the thread that is running serve_forever()
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def serve_prefork(server, processes, on_worker_exit=None):
+    """Run `processes` forked copies of an already listening server
+
+    Every worker inherits the listening socket and accepts connections from
+    it, so the kernel spreads clients across processes and the GIL only
+    limits each worker to one core. The parent process supervises:
+
+    * a worker that dies unexpectedly is replaced
+    * SIGHUP replaces the workers one at a time (rolling restart)
+    * SIGINT/SIGTERM stop every worker gracefully and then return
+
+    `on_worker_exit` is called in each worker after it stops serving.
+    """
+    workers = set()
+    flags = {"stopping": False, "restart": False}
+
+    def spawn_worker():
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                serve_until_signalled(server)
+                if on_worker_exit is not None:
+                    on_worker_exit()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        workers.add(pid)
+        return pid
+
+    def request_stop(signum, frame):
+        flags["stopping"] = True
+
+    def request_restart(signum, frame):
+        flags["restart"] = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGHUP, request_restart)
+
+    for _ in range(processes):
+        spawn_worker()
+
+    try:
+        while not flags["stopping"]:
+            if flags["restart"]:
+                flags["restart"] = False
+                _rolling_restart(workers, spawn_worker, flags)
+                continue
+
+            # Poll so that signal flags are noticed promptly
+            pid, exit_status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            if pid in workers:
+                workers.discard(pid)
+                sys.stderr.write(f"Worker {pid} exited with status {exit_status}, starting a replacement\n")
+                time.sleep(_RESPAWN_DELAY)
+                spawn_worker()
+    finally:
+        for pid in workers:
+            _signal_worker(pid, signal.SIGTERM)
+        for pid in workers:
+            _wait_for_worker(pid)
+        server.server_close()
+
+
+def _rolling_restart(workers, spawn_worker, flags):
+    """Replace every worker, starting the new one before stopping the old"""
+    for old_pid in list(workers):
+        if flags["stopping"]:
+            return
+        spawn_worker()
+        workers.discard(old_pid)
+        _signal_worker(old_pid, signal.SIGTERM)
+        _wait_for_worker(old_pid)
+
+
+def _signal_worker(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _wait_for_worker(pid):
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
@@ -0,0 +1,203 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from compression import ENCODINGS
+
+
+def make_etag(body):
+    """Strong ETag for a response body (bytes)"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an ETag"""
+    if if_none_match is None:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+def if_match_satisfied(if_match, etag):
+    """Check an If-Match header value against the current ETag
+
+    If-Match uses the strong comparison, so weak candidates never match.
+    The "-gzip" or "-deflate" that compressed responses add to the ETag is
+    ignored, since every coding represents the same resource state.
+    """
+    for candidate in if_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            continue
+        for encoding in ENCODINGS:
+            suffix = "-" + encoding + '"'
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)] + '"'
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache():
+    """Bounded LRU cache of serialized GET responses
+
+    Entries are keyed by request path and tagged with the resources their
+    body was built from (e.g. a /books page is tagged books, reviews,
+    categories and users). Writing to a resource invalidates every entry
+    carrying its tag.
+
+    Each tag also has a generation number. A request records the
+    generations before it queries the database and the response is only
+    stored if none of them moved, so a write that lands while the response
+    is being built can never leave stale data in the cache.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=4096, version_check=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # Optional callable returning a value that changes whenever another
+        # process writes to the database; a change clears the whole cache
+        self.version_check = version_check
+
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._size = 0
+        self._seen_version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, key):
+        """Get the cached entry for a key, or None on a miss"""
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def snapshot(self, tags):
+        """Record the current generation of each tag, to pass to store()"""
+        with self._lock:
+            return self._current_generations(tags)
+
+    def store(self, key, body, headers, tags, snapshot):
+        """Cache a response body unless one of its tags changed since snapshot
+
+        Returns the new entry, or None when the body was not cached.
+        """
+        if len(body) > self.max_bytes:
+            return None
+        with self._lock:
+            if self._current_generations(tags) != snapshot:
+                return None
+
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= self._entry_size(old_entry)
+
+            entry = {
+                "key": key,
+                "body": body,
+                "etag": headers["ETag"],
+                "headers": headers,
+                "tags": frozenset(tags),
+                # Compressed copies of the body, by content coding
+                "variants": {},
+            }
+            self._entries[key] = entry
+            self._size += len(body)
+            self._evict()
+            return entry
+
+    def variant(self, entry, encoding, build):
+        """Get a compressed copy of an entry's body, building it only once
+
+        `build` is called without the lock held when the copy is missing.
+        The copy is kept with the entry (and counted against max_bytes)
+        as long as the entry is still cached.
+        """
+        with self._lock:
+            data = entry["variants"].get(encoding)
+        if data is not None:
+            return data
+
+        data = build()
+        with self._lock:
+            if self._entries.get(entry["key"]) is entry and encoding not in entry["variants"]:
+                entry["variants"][encoding] = data
+                self._size += len(data)
+                self._evict()
+        return data
+
+    def invalidate(self, *tags):
+        """Drop every entry built from any of the given resources"""
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale_keys = [key for key, entry in self._entries.items() if entry["tags"].intersection(tags)]
+            for key in stale_keys:
+                self._size -= self._entry_size(self._entries.pop(key))
+            self.invalidations += len(stale_keys)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        """Counters describing how well the cache is doing"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _entry_size(self, entry):
+        return len(entry["body"]) + sum(len(data) for data in entry["variants"].values())
+
+    def _evict(self):
+        # Drop least recently used entries until back within bounds
+        while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= self._entry_size(evicted)
+            self.evictions += 1
+
+    def _current_generations(self, tags):
+        return (self._epoch,) + tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def _clear(self):
+        # A new epoch also stops responses that are being built from storing
+        self._epoch += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._size = 0
+
+    def _check_version(self):
+        if self.version_check is None:
+            return
+        version = self.version_check()
+        if version != self._seen_version:
+            if self._seen_version is not None:
+                self._clear()
+            self._seen_version = version
@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import database
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Runs each test against a migrated copy of janesreviews.sqlite3
+
+    The copy lives in a temporary directory, at self.path, and is thrown
+    away after the test, so tests may write to it freely.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="janesreviews-test-")
+        self.path = os.path.join(self.workdir, "janesreviews.sqlite3")
+        shutil.copy(os.path.join(ROOT, "janesreviews.sqlite3"), self.path)
+        self.previous_path = database.settings["path"]
+        database.configure(path=self.path)
+        database.migrations.migrate()
+
+    def tearDown(self):
+        database.configure(path=self.previous_path)
+        shutil.rmtree(self.workdir)
@@ -0,0 +1,74 @@
+"""PATCH /books/{id} with If-Match never overwrites a change it did not see
+
+    python -m unittest tests.test_books_patch
+"""
+import json
+import sqlite3
+import unittest
+
+import database
+from tests import DatabaseTestCase
+from views import Books, PreconditionFailed
+
+
+class BooksPatchTest(DatabaseTestCase):
+
+    def title(self, pk):
+        return json.loads(Books().get_single(pk))["title"]
+
+    def test_matching_precondition_updates_only_given_columns(self):
+        before = json.loads(Books().get_single(1))
+        seen = Books().get_single(1)
+        checks = []
+
+        def precondition(current):
+            checks.append(current)
+            return current == seen
+
+        body = Books().patch(1, {"title": "Patched"}, precondition)
+        # Nothing else wrote, so the book was not read again under the lock
+        self.assertEqual(len(checks), 1)
+        after = json.loads(body)
+        self.assertEqual(after["title"], "Patched")
+        self.assertEqual(after["author"], before["author"])
+
+    def test_failed_precondition_changes_nothing(self):
+        with self.assertRaises(PreconditionFailed):
+            Books().patch(1, {"title": "Patched"}, lambda current: False)
+        self.assertNotEqual(self.title(1), "Patched")
+
+    def test_write_between_check_and_lock_is_checked_again(self):
+        seen = Books().get_single(1)
+        checks = []
+
+        def precondition(current):
+            checks.append(current)
+            if len(checks) == 1:
+                # Another client updates the book right after the first check
+                other = sqlite3.connect(self.path)
+                with other:
+                    other.execute("UPDATE Book SET title = 'Concurrent' WHERE id = 1")
+                other.close()
+            return current == seen
+
+        with self.assertRaises(PreconditionFailed):
+            Books().patch(1, {"author": "Patched"}, precondition)
+        self.assertEqual(len(checks), 2)
+        self.assertEqual(self.title(1), "Concurrent")
+
+    def test_categories_are_diffed(self):
+        with database.get_connection() as conn:
+            rows_before = {row["category_id"]: row["id"] for row in conn.execute(
+                "SELECT id, category_id FROM BookCategory WHERE book_id = 1")}
+        kept = next(iter(rows_before))
+        Books().patch(1, {"categories": [kept, 7]})
+        with database.get_connection() as conn:
+            rows_after = {row["category_id"]: row["id"] for row in conn.execute(
+                "SELECT id, category_id FROM BookCategory WHERE book_id = 1")}
+        self.assertEqual(set(rows_after), {kept, 7})
+        # The unchanged association kept its row
+        self.assertEqual(rows_after[kept], rows_before[kept])
+
+
+if __name__ == "__main__":
+    unittest.main()
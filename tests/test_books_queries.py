@@ -0,0 +1,50 @@
+"""The books listing runs a fixed number of SQL statements per page
+
+    python -m unittest tests.test_books_queries
+"""
+import unittest
+
+import database
+from database import instrument
+from tests import DatabaseTestCase
+from views import Books
+
+
+class BooksQueryCountTest(DatabaseTestCase):
+
+    def add_books(self, count):
+        """Insert count books, each with two categories and three reviews"""
+        with database.get_connection() as conn:
+            start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM Book").fetchone()[0] + 1
+            book_ids = range(start, start + count)
+            conn.executemany("""
+            INSERT INTO Book (id, title, author, isbn, publication_date, user_id)
+            VALUES (?, ?, 'Test Author', ?, '2020-01-01', 1)
+            """, [(book_id, f"Test book {book_id}", f"test-{book_id}") for book_id in book_ids])
+            conn.executemany("""
+            INSERT INTO BookCategory (book_id, category_id) VALUES (?, ?)
+            """, [(book_id, category_id) for book_id in book_ids for category_id in (1, 2)])
+            conn.executemany("""
+            INSERT INTO Review (book_id, user_id, rating, review_text) VALUES (?, ?, ?, 'Fine')
+            """, [(book_id, user_id, user_id) for book_id in book_ids for user_id in (1, 2, 3)])
+
+    def statements_for_page(self):
+        """Statements run by Books.get_all for one page holding every book"""
+        counts = instrument.reset()
+        body, next_cursor = Books().get_all(limit=1000)
+        self.assertIsNone(next_cursor)
+        return counts.statements
+
+    def test_statements_do_not_grow_with_books(self):
+        self.add_books(20)
+        with_few_books = self.statements_for_page()
+
+        self.add_books(180)
+        with_many_books = self.statements_for_page()
+
+        self.assertGreater(with_few_books, 0)
+        self.assertEqual(with_few_books, with_many_books)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Requests on a kept-alive connection never run into each other
+
+    python -m unittest tests.test_keep_alive
+"""
+import http.client
+import importlib.util
+import json
+import os
+import threading
+import unittest
+from http.server import HTTPServer
+from unittest import mock
+
+from tests import DatabaseTestCase, ROOT
+
+
+def load_json_server():
+    """The json-server.py module, whose name is not importable"""
+    spec = importlib.util.spec_from_file_location("json_server", os.path.join(ROOT, "json-server.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+json_server = load_json_server()
+
+
+class KeepAliveTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = HTTPServer(("127.0.0.1", 0), json_server.JSONServer)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.conn = http.client.HTTPConnection("127.0.0.1", self.server.server_port, timeout=5)
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super().tearDown()
+
+    def request(self, method, path, body=None):
+        """Send one request on the shared connection, returning the response and its body"""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def assert_next_request_is_served(self):
+        response, body = self.request("GET", "/books/1")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(body)["id"], 1)
+
+    def test_unread_delete_body_is_skipped(self):
+        response, _ = self.request("DELETE", "/categories/1", {"reason": "unused"})
+        self.assertEqual(response.status, 404)
+        self.assert_next_request_is_served()
+
+    def test_unread_patch_body_is_skipped(self):
+        response, _ = self.request("PATCH", "/reviews/2", {"rating": 1})
+        self.assertEqual(response.status, 404)
+        self.assert_next_request_is_served()
+
+    def test_patched_book_on_the_same_connection(self):
+        response, _ = self.request("PATCH", "/books/1", {"title": "Patched"})
+        self.assertEqual(response.status, 200)
+        response, body = self.request("GET", "/books/1")
+        self.assertEqual(json.loads(body)["title"], "Patched")
+
+    def test_unread_bulk_body_is_skipped(self):
+        response, _ = self.request("POST", "/categories/bulk", [{"category_name": "Unused"}])
+        self.assertEqual(response.status, 404)
+        self.assert_next_request_is_served()
+
+    def test_body_too_large_to_skip_closes_the_connection(self):
+        with mock.patch.object(json_server.JSONServer, "max_discard_size", 4):
+            response, _ = self.request("DELETE", "/categories/1", {"reason": "unused"})
+            self.assertEqual(response.status, 404)
+            # The server hung up rather than reading the body as a request
+            with self.assertRaises((ConnectionError, http.client.HTTPException)):
+                self.request("GET", "/books/1")
+            self.conn.close()
+            self.assert_next_request_is_served()
+
+    def test_no_content_has_no_content_length(self):
+        response, body = self.request("DELETE", "/reviews/2")
+        self.assertEqual(response.status, 204)
+        self.assertIsNone(response.getheader("Content-Length"))
+        self.assertEqual(body, b"")
+        self.assert_next_request_is_served()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Page cursors always match the rows of the page they come with
+
+    python -m unittest tests.test_paging
+"""
+import sqlite3
+import unittest
+
+from nss_handler import HandleRequests
+from tests import DatabaseTestCase
+from views import Books, Reviews
+
+
+class NextLinkTest(unittest.TestCase):
+
+    def next_link(self, path, limit, next_cursor):
+        # page_headers() only needs the request path
+        handler = HandleRequests.__new__(HandleRequests)
+        handler.path = path
+        return handler.page_headers(limit, next_cursor)["Link"]
+
+    def test_next_link_keeps_blank_include(self):
+        link = self.next_link("/books?limit=2&include=", 2, 2)
+        self.assertEqual(link, '</books?limit=2&include=&after=2>; rel="next"')
+
+    def test_next_link_replaces_after(self):
+        link = self.next_link("/books?after=2&limit=2&fields=id,title", 2, 5)
+        self.assertEqual(link, '</books?after=5&limit=2&fields=id%2Ctitle>; rel="next"')
+
+
+class StreamedPageTest(DatabaseTestCase):
+
+    def write_elsewhere(self, sql, params=()):
+        """Run a write through a connection of another client"""
+        other = sqlite3.connect(self.path)
+        with other:
+            other.execute(sql, params)
+        other.close()
+
+    def test_books_cursor_matches_streamed_rows(self):
+        next_cursor, books = Books().iter_page(limit=2)
+        # The last book of the page is deleted after the cursor was sent
+        self.write_elsewhere("DELETE FROM Book WHERE id = ?", (next_cursor,))
+        ids = [book["id"] for book in books]
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids[-1], next_cursor)
+
+    def test_reviews_cursor_matches_streamed_rows(self):
+        next_cursor, reviews = Reviews().iter_page(limit=1)
+        self.write_elsewhere("DELETE FROM Review WHERE id = ?", (next_cursor,))
+        ids = [review["id"] for review in reviews]
+        self.assertEqual(ids, [next_cursor])
+
+    def test_transaction_ends_with_the_stream(self):
+        next_cursor, books = Books().iter_page(limit=2)
+        list(books)
+        # Writes from this thread's connection work again
+        Books().patch(next_cursor, {"title": "After the stream"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+"""Every hot query reaches its tables through an index
+
+    python -m unittest tests.test_query_plans
+
+The same check as `python -m database check-indexes`, run against a
+freshly migrated database, so a migration that loses an index fails here.
+"""
+import unittest
+
+import database
+from database import plans
+from tests import DatabaseTestCase
+
+
+class HotQueryPlanTest(DatabaseTestCase):
+
+    def test_hot_queries_use_indexes(self):
+        self.assertEqual(plans.find_table_scans(), [])
+
+    def test_dropped_index_is_caught(self):
+        with database.get_connection() as conn:
+            conn.execute("DROP INDEX Review_book_id")
+        names = [name for name, plan in plans.find_table_scans()]
+        self.assertIn("book reviews", names)
+
+    def test_sort_without_index_is_caught(self):
+        with database.get_connection() as conn:
+            conn.execute("DROP INDEX BookStats_score")
+            # Still no table scan, but every qualifying row gets sorted
+            conn.execute("CREATE INDEX BookStats_review_count ON BookStats (review_count)")
+        names = [name for name, plan in plans.find_table_scans()]
+        self.assertIn("top rated books", names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+"""A user's books and reviews page like the full listings
+
+    python -m unittest tests.test_users
+"""
+import json
+import unittest
+
+from tests import DatabaseTestCase
+from views import Books, Users
+
+
+class UserListingTest(DatabaseTestCase):
+
+    def book_pages(self, user_id, limit):
+        """Ids of every page of a user's books, following the cursors"""
+        pages = []
+        after = 0
+        while after is not None:
+            body, after = Users().get_books(user_id, Books(["id", "user_id"]), limit, after)
+            pages.append([book["id"] for book in json.loads(body)])
+            self.assertTrue(all(book["user_id"] == user_id for book in json.loads(body)))
+        return pages
+
+    def test_books_page_through_the_users_books_only(self):
+        self.assertEqual(self.book_pages(1, 2), [[1, 2], [9]])
+
+    def test_reviews_are_the_users_only(self):
+        body, next_cursor = Users().get_reviews(3, 10)
+        self.assertEqual([review["id"] for review in json.loads(body)], [3])
+        self.assertIsNone(next_cursor)
+
+    def test_missing_user(self):
+        self.assertEqual(Users().get_reviews(999, 10), (None, None))
+        self.assertEqual(Users().get_books(999, Books(), 10), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""The group-commit writer never leaves a caller waiting forever
+
+    python -m unittest tests.test_writer
+"""
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+
+import database
+from database import writer
+from tests import DatabaseTestCase
+
+
+INSERT_REVIEW = "INSERT INTO Review (book_id, user_id, rating, review_text) VALUES (1, 1, 5, ?)"
+
+
+class GroupCommitWriterTest(DatabaseTestCase):
+
+    def test_insert_commits(self):
+        group_writer = writer.GroupCommitWriter(window_ms=1)
+        review_id = group_writer.insert(INSERT_REVIEW, ("Grouped",))
+        row = database.get_connection().execute("SELECT review_text FROM Review WHERE id = ?", (review_id,)).fetchone()
+        self.assertEqual(row["review_text"], "Grouped")
+
+    def test_connection_error_reaches_caller(self):
+        group_writer = writer.GroupCommitWriter(window_ms=1)
+        with mock.patch.object(writer, "get_connection", side_effect=sqlite3.OperationalError("unable to open database file")):
+            with self.assertRaises(sqlite3.OperationalError):
+                group_writer.insert(INSERT_REVIEW, ("Lost",))
+        # The thread survived and serves the next insert
+        self.assertIsNotNone(group_writer.insert(INSERT_REVIEW, ("Kept",)))
+
+    def test_dead_thread_is_replaced(self):
+        group_writer = writer.GroupCommitWriter(window_ms=1)
+        uncaught = []
+        # The SystemExit ends the writer thread, which would otherwise be
+        # reported as an unhandled thread exception
+        with mock.patch.object(threading, "excepthook", uncaught.append):
+            with mock.patch.object(group_writer, "_commit", side_effect=SystemExit):
+                with self.assertRaises(SystemExit):
+                    group_writer.insert(INSERT_REVIEW, ("Lost",))
+            group_writer._thread.join(5)
+        self.assertFalse(group_writer._thread.is_alive())
+        self.assertEqual([args.exc_type for args in uncaught], [SystemExit])
+        self.assertIsNotNone(group_writer.insert(INSERT_REVIEW, ("Kept",)))
+
+    def test_stuck_writer_times_out_and_withdraws_the_row(self):
+        group_writer = writer.GroupCommitWriter(window_ms=1, timeout_ms=100)
+        stuck = threading.Event()
+        release = threading.Event()
+        commit = group_writer._commit
+
+        def stuck_commit(batch):
+            stuck.set()
+            release.wait(5)
+            commit(batch)
+
+        with mock.patch.object(group_writer, "_commit", side_effect=stuck_commit):
+            # The first insert holds the writer, so the second never starts
+            first = threading.Thread(target=group_writer.insert, args=(INSERT_REVIEW, ("First",)))
+            first.start()
+            stuck.wait(5)
+            with self.assertRaisesRegex(sqlite3.OperationalError, "busy"):
+                group_writer.insert(INSERT_REVIEW, ("Withdrawn",))
+            release.set()
+            first.join(5)
+
+        texts = [row["review_text"] for row in database.get_connection().execute("SELECT review_text FROM Review")]
+        self.assertIn("First", texts)
+        self.assertNotIn("Withdrawn", texts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
 from .reviews import Reviews
-from .books import Books
-from .categories import Categories
\ No newline at end of file
+from .books import Books, PreconditionFailed
+from .categories import Categories
+from .users import Users
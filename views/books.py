@@ -1,158 +1,568 @@
 import datetime
-import sqlite3
 import json
+import sqlite3
+from database import get_connection, get_read_connection, bulk, search
+
+
+class PreconditionFailed(Exception):
+    """The book changed since the client read it (If-Match did not match)"""
 
 
 class Books():
 
-    def get_all(self):
-        """Get all books from the database with their categories and reviews"""
+    # Columns a client can pick with ?fields=, in response order
+    COLUMNS = {
+        "id": "b.id",
+        "title": "b.title",
+        "author": "b.author",
+        "isbn": "b.isbn",
+        "publication_date": "b.publication_date",
+        "user_id": "b.user_id",
+        "username": "u.username",
+    }
+    # Fields computed from the BookStats row
+    STATS_FIELDS = ("review_count", "avg_rating", "rating_histogram")
+    # Lists a client can embed with ?include=
+    INCLUDES = ("categories", "reviews")
+    # Columns a PATCH may change
+    UPDATABLE = ("title", "author", "isbn", "publication_date", "user_id")
+    # Categories with at most this many books are ranked by sorting their
+    # books; larger ones by walking the overall ranking (see get_top)
+    TOP_SORT_MAX_BOOKS = 2000
+
+    def __init__(self, fields=None, include=None):
+        """Choose the shape of the book dictionaries this view returns
+
+        `fields` lists the book fields to return and `include` the lists to
+        embed. With neither, books have every field and embed categories and
+        reviews. Giving `fields` alone embeds nothing. Raises ValueError
+        naming any field or include the view does not know, and when
+        `fields` is given but empty (e.g. ?fields= with no value), since
+        books with no fields would be empty objects.
+        """
+        if fields is not None and not fields:
+            raise ValueError("fields must name at least one field")
+        if fields is None:
+            fields = list(self.COLUMNS) + list(self.STATS_FIELDS)
+            if include is None:
+                include = self.INCLUDES
+        if include is None:
+            include = ()
+
+        unknown = [field for field in fields if field not in self.COLUMNS and field not in self.STATS_FIELDS]
+        if unknown:
+            raise ValueError("Unknown fields: " + ", ".join(unknown))
+        unknown = [name for name in include if name not in self.INCLUDES]
+        if unknown:
+            raise ValueError("Unknown include: " + ", ".join(unknown))
+
+        self.fields = set(fields)
+        self.include = set(include)
+
+    def get_all(self, limit, after=0, where=None, params=()):
+        """Get a page of books with their categories and reviews
+
+        Returns the JSON for at most `limit` books whose id is greater than
+        `after`, and the cursor for the next page (None on the last page).
+        `where` is an optional SQL condition the books must also meet, with
+        its `params`, e.g. "b.user_id = ?" and (3,).
+        """
+        condition = "b.id > ?"
+        if where is not None:
+            condition = f"{where} AND {condition}"
+
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to get the information you want
-            db_cursor.execute("""
-            SELECT
-                b.id,
-                b.title,
-                b.author,
-                b.isbn,
-                b.publication_date,
-                b.user_id,
-                u.username
-            FROM Book b
-            JOIN User u ON b.user_id = u.id
-            """)
+            db_cursor.execute(self._select_books() + f"""
+            WHERE {condition}
+            ORDER BY b.id
+            LIMIT ?
+            """, (*params, after, limit + 1))
             query_results = db_cursor.fetchall()
 
             # Initialize an empty list and then add each dictionary to it
             books = []
-            for row in query_results:
-                book = dict(row)
+            for row in query_results[:limit]:
+                books.append(self._book_from_row(row))
+
+            # One extra row was requested to find out if another page exists
+            next_cursor = None
+            if len(query_results) > limit:
+                next_cursor = books[-1]["id"]
+
+            # Load categories and reviews for the whole page in two queries
+            self._attach_related(db_cursor, books)
+
+            return json.dumps(self._shape(books)), next_cursor
 
-                # Get categories for this book
+    def get_in_categories(self, category_ids, match, limit, after=0):
+        """Get a page of the books filed under some categories
+
+        With match "any" a book needs one of `category_ids`, with "all" it
+        needs every one of them. Pages work like get_all(): at most `limit`
+        books whose id is greater than `after`, plus the next cursor.
+        """
+        books, next_cursor = self.page_in_categories(category_ids, match, limit, after)
+        return json.dumps(books), next_cursor
+
+    def page_in_categories(self, category_ids, match, limit, after=0):
+        """Like get_in_categories(), but returns the list of book dictionaries"""
+        category_ids = list(dict.fromkeys(category_ids))
+
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            if match == "any" or len(category_ids) == 1:
+                # Read the first limit + 1 books of each category from the
+                # (category_id, book_id) index, then merge them. A single
+                # IN (...) query would sort every book of every category.
+                legs = " UNION ".join("""
+                SELECT * FROM (
+                    SELECT book_id FROM BookCategory
+                    WHERE category_id = ? AND book_id > ?
+                    ORDER BY book_id
+                    LIMIT ?
+                )""" for _ in category_ids)
+                params = []
+                for category_id in category_ids:
+                    params.extend((category_id, after, limit + 1))
+                db_cursor.execute(legs + """
+                ORDER BY book_id
+                LIMIT ?
+                """, (*params, limit + 1))
+            else:
+                # Walk the smallest category and probe the others per book
+                db_cursor.execute(f"""
+                SELECT category_id
+                FROM CategoryStats
+                WHERE category_id IN ({", ".join("?" * len(category_ids))})
+                ORDER BY book_count
+                """, tuple(category_ids))
+                counted = [row["category_id"] for row in db_cursor.fetchall()]
+                if len(counted) < len(category_ids):
+                    # A category without books matches nothing
+                    return [], None
+
+                others = " ".join(f"""
+                AND EXISTS (
+                    SELECT 1 FROM BookCategory other{index}
+                    WHERE other{index}.book_id = bc.book_id AND other{index}.category_id = ?
+                )""" for index in range(len(counted) - 1))
+                db_cursor.execute(f"""
+                SELECT bc.book_id
+                FROM BookCategory bc
+                WHERE bc.category_id = ?
+                AND bc.book_id > ?
+                {others}
+                ORDER BY bc.book_id
+                LIMIT ?
+                """, (counted[0], after, *counted[1:], limit + 1))
+            book_ids = [row["book_id"] for row in db_cursor.fetchall()]
+
+            # One extra book was requested to find out if another page exists
+            next_cursor = None
+            if len(book_ids) > limit:
+                book_ids = book_ids[:limit]
+                next_cursor = book_ids[-1]
+
+            books = self._load_books(db_cursor, book_ids)
+
+            return self._shape(books), next_cursor
+
+    def get_top(self, limit, category_id=None, min_reviews=1):
+        """Get the best rated books, optionally only those in one category
+
+        Books are ranked by the Bayesian average in BookStats.score and
+        only books with at least `min_reviews` reviews are ranked. Each
+        book gets its "score" on top of the requested fields.
+        """
+        min_reviews = max(min_reviews, 1)
+
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            if category_id is None:
+                # Read the score index from the top down to the LIMIT
                 db_cursor.execute("""
-                SELECT
-                    c.id,
-                    c.category_name
-                FROM Category c
-                JOIN BookCategory bc ON c.id = bc.category_id
-                WHERE bc.book_id = ?
-                """, (book["id"],))
-
-                categories = []
-                category_results = db_cursor.fetchall()
-                for category_row in category_results:
-                    categories.append(dict(category_row))
-
-                # Add categories to book
-                book["categories"] = categories
-
-                # Get reviews for this book
+                SELECT s.book_id, s.score
+                FROM BookStats s
+                WHERE s.review_count >= ?
+                ORDER BY s.score DESC, s.review_count DESC, s.book_id
+                LIMIT ?
+                """, (min_reviews, limit))
+            else:
                 db_cursor.execute("""
-                SELECT
-                    r.id,
-                    r.rating,
-                    r.review_text,
-                    r.user_id,
-                    u.username
-                FROM Review r
-                JOIN User u ON r.user_id = u.id
-                WHERE r.book_id = ?
-                """, (book["id"],))
-
-                reviews = []
-                review_results = db_cursor.fetchall()
-                for review_row in review_results:
-                    reviews.append(dict(review_row))
-
-                # Add reviews to book
-                book["reviews"] = reviews
-
-                books.append(book)
+                SELECT book_count
+                FROM CategoryStats
+                WHERE category_id = ?
+                """, (category_id,))
+                row = db_cursor.fetchone()
+                book_count = row["book_count"] if row is not None else 0
+
+                if book_count <= self.TOP_SORT_MAX_BOOKS:
+                    # A small category is quicker to rank on its own than to
+                    # find among the top books overall
+                    db_cursor.execute("""
+                    SELECT s.book_id, s.score
+                    FROM BookCategory bc
+                    CROSS JOIN BookStats s ON s.book_id = bc.book_id
+                    WHERE bc.category_id = ? AND s.review_count >= ?
+                    ORDER BY s.score DESC, s.review_count DESC, s.book_id
+                    LIMIT ?
+                    """, (category_id, min_reviews, limit))
+                else:
+                    # Walk the score index, keeping the books in the category
+                    db_cursor.execute("""
+                    SELECT s.book_id, s.score
+                    FROM BookStats s
+                    WHERE s.review_count >= ?
+                    AND EXISTS (
+                        SELECT 1 FROM BookCategory bc
+                        WHERE bc.book_id = s.book_id AND bc.category_id = ?
+                    )
+                    ORDER BY s.score DESC, s.review_count DESC, s.book_id
+                    LIMIT ?
+                    """, (min_reviews, category_id, limit))
+
+            scores = {}
+            for row in db_cursor.fetchall():
+                scores[row["book_id"]] = row["score"]
+
+            books = self._load_books(db_cursor, list(scores))
+            # ?fields= may drop the id, so look the scores up before shaping
+            book_scores = [round(scores[book["id"]], 3) for book in books]
+            self._shape(books)
+            for book, score in zip(books, book_scores):
+                book["score"] = score
 
             return json.dumps(books)
 
+    def iter_page(self, limit, after=0, batch_size=200):
+        """Stream a page of books without holding the whole page in memory
+
+        Returns the cursor for the next page and a generator of book
+        dictionaries. Books are read from SQLite `batch_size` rows at a time
+        and the categories and reviews are loaded for one batch at a time.
+        """
+        books = self._iter_books(get_read_connection(), limit, after, batch_size)
+        # The first item is the cursor, which is sent before the body
+        next_cursor = next(books)
+        return next_cursor, books
+
+    def _iter_books(self, conn, limit, after, batch_size):
+        # The cursor and the rows are read in one transaction, so a write
+        # in between cannot make the cursor skip or repeat a row
+        conn.execute("BEGIN")
+        try:
+            # The cursor comes first. Finding it only walks the primary key
+            # index.
+            db_cursor = conn.cursor()
+            db_cursor.execute("""
+            SELECT b.id
+            FROM Book b
+            JOIN User u ON b.user_id = u.id
+            WHERE b.id > ?
+            ORDER BY b.id
+            LIMIT 2 OFFSET ?
+            """, (after, limit - 1))
+            boundary = db_cursor.fetchall()
+
+            next_cursor = None
+            if len(boundary) == 2:
+                next_cursor = boundary[0]["id"]
+            yield next_cursor
+
+            db_cursor = conn.cursor()
+            related_cursor = conn.cursor()
+
+            db_cursor.execute(self._select_books() + """
+            WHERE b.id > ?
+            ORDER BY b.id
+            LIMIT ?
+            """, (after, limit))
+
+            while True:
+                rows = db_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                books = []
+                for row in rows:
+                    books.append(self._book_from_row(row))
+                self._attach_related(related_cursor, books)
+
+                yield from self._shape(books)
+        finally:
+            conn.commit()
+
     def get_single(self, pk):
         """Get a single book by id with its categories and reviews"""
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_connection() as conn:
+            return self._single_json(conn.cursor(), pk)
+
+    def _single_json(self, db_cursor, pk):
+        """JSON of one book, read through db_cursor, or None if it is missing"""
+        # Write the SQL query to get the information you want
+        db_cursor.execute(self._select_books() + """
+        WHERE b.id = ?
+        """, (pk,))
+
+        # Load the single result into memory
+        data = db_cursor.fetchone()
+
+        # Check if data was found
+        if data is not None:
+            # Create a dictionary from the database record
+            book = self._book_from_row(data)
+
+            # Add categories and reviews to the book
+            self._attach_related(db_cursor, [book])
+
+            return json.dumps(self._shape([book])[0])
+        else:
+            return None
+
+    def search(self, text, limit, after=0):
+        """Find books whose title or author match the search text
+
+        Results are ranked by bm25, best first. `after` is the number of
+        results already seen, and the cursor for the next page is returned
+        alongside the JSON (None on the last page). Returns None, None when
+        the text has nothing to search for.
+        """
+        match = search.match_expression(text)
+        if match is None:
+            return None, None
+
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            # Rank the matches using only the search index
+            db_cursor.execute("""
+            SELECT id
+            FROM (
+                SELECT rowid AS id, bm25(BookSearch) AS score
+                FROM BookSearch
+                WHERE BookSearch MATCH ?
+                ORDER BY rowid DESC
+                LIMIT ?
+            )
+            ORDER BY score
+            LIMIT ? OFFSET ?
+            """, (match, search.MAX_RANKED_MATCHES, limit + 1, after))
+            book_ids = [row["id"] for row in db_cursor.fetchall()]
+
+            # One extra match was requested to find out if another page exists
+            next_cursor = None
+            if len(book_ids) > limit:
+                book_ids = book_ids[:limit]
+                next_cursor = after + limit
+
+            books = self._load_books(db_cursor, book_ids)
+
+            return json.dumps(self._shape(books)), next_cursor
+
+    def get_many(self, book_ids):
+        """Get several books by id with set-based queries
+
+        Books come back in the order of `book_ids`; an id that does not
+        match a book gives {"id": id, "missing": true} in its place.
+        """
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            loaded = self._load_books(db_cursor, list(dict.fromkeys(book_ids)))
+            books_by_id = {}
+            for book in loaded:
+                books_by_id[book["id"]] = book
+            # ?fields= may drop the id, so shape only after indexing by it
+            self._shape(loaded)
+
+            books = []
+            for book_id in book_ids:
+                books.append(books_by_id.get(book_id, {"id": book_id, "missing": True}))
+
+            return json.dumps(books)
+
+    def _load_books(self, db_cursor, book_ids):
+        """Get the book dictionaries for a list of ids, in the same order
+
+        Ids that do not match a book are left out.
+        """
+        if not book_ids:
+            return []
+
+        placeholders = ", ".join("?" * len(book_ids))
+        db_cursor.execute(self._select_books() + f"""
+        WHERE b.id IN ({placeholders})
+        """, tuple(book_ids))
+
+        books_by_id = {}
+        for row in db_cursor.fetchall():
+            books_by_id[row["id"]] = self._book_from_row(row)
+
+        books = [books_by_id[book_id] for book_id in book_ids if book_id in books_by_id]
+        self._attach_related(db_cursor, books)
+        return books
+
+    def get_stats(self, pk):
+        """Get the precomputed review count, average and histogram for a book"""
+        # Open a connection to the database
+        with get_read_connection() as conn:
             db_cursor = conn.cursor()
 
-            # Write the SQL query to get the information you want
             db_cursor.execute("""
             SELECT
-                b.id,
-                b.title,
-                b.author,
-                b.isbn,
-                b.publication_date,
-                b.user_id,
-                u.username
+                b.id AS book_id,
+                COALESCE(s.review_count, 0) AS review_count,
+                COALESCE(s.rating_sum, 0) AS rating_sum,
+                COALESCE(s.rating_1, 0) AS rating_1,
+                COALESCE(s.rating_2, 0) AS rating_2,
+                COALESCE(s.rating_3, 0) AS rating_3,
+                COALESCE(s.rating_4, 0) AS rating_4,
+                COALESCE(s.rating_5, 0) AS rating_5
             FROM Book b
-            JOIN User u ON b.user_id = u.id
+            LEFT JOIN BookStats s ON s.book_id = b.id
             WHERE b.id = ?
             """, (pk,))
 
-            # Load the single result into memory
             data = db_cursor.fetchone()
 
-            # Check if data was found
             if data is not None:
-                # Create a dictionary from the database record
-                book = dict(data)
-
-                # Get categories for this book
-                db_cursor.execute("""
-                SELECT
-                    c.id,
-                    c.category_name
-                FROM Category c
-                JOIN BookCategory bc ON c.id = bc.category_id
-                WHERE bc.book_id = ?
-                """, (book["id"],))
-
-                categories = []
-                category_results = db_cursor.fetchall()
-                for category_row in category_results:
-                    categories.append(dict(category_row))
-
-                # Add categories to book
-                book["categories"] = categories
-
-                # Get reviews for this book
-                db_cursor.execute("""
-                SELECT
-                    r.id,
-                    r.rating,
-                    r.review_text,
-                    r.user_id,
-                    u.username
-                FROM Review r
-                JOIN User u ON r.user_id = u.id
-                WHERE r.book_id = ?
-                """, (book["id"],))
-
-                reviews = []
-                review_results = db_cursor.fetchall()
-                for review_row in review_results:
-                    reviews.append(dict(review_row))
-
-                # Add reviews to book
-                book["reviews"] = reviews
-
-                return json.dumps(book)
+                return json.dumps(self._with_rating_stats(dict(data)))
             else:
                 return None
 
+    def _select_books(self):
+        """SELECT ... FROM for the book columns this view returns
+
+        The id is always selected because cursors and the embedded lists
+        need it. BookStats is only joined when a stats field was requested.
+        """
+        columns = []
+        for field, column in self.COLUMNS.items():
+            if field == "id" or field in self.fields:
+                columns.append(column)
+
+        stats_join = ""
+        if self.fields.intersection(self.STATS_FIELDS):
+            columns.extend([
+                "COALESCE(s.review_count, 0) AS review_count",
+                "COALESCE(s.rating_sum, 0) AS rating_sum",
+                "COALESCE(s.rating_1, 0) AS rating_1",
+                "COALESCE(s.rating_2, 0) AS rating_2",
+                "COALESCE(s.rating_3, 0) AS rating_3",
+                "COALESCE(s.rating_4, 0) AS rating_4",
+                "COALESCE(s.rating_5, 0) AS rating_5",
+            ])
+            stats_join = "LEFT JOIN BookStats s ON s.book_id = b.id"
+
+        return f"""
+        SELECT
+            {", ".join(columns)}
+        FROM Book b
+        JOIN User u ON b.user_id = u.id
+        {stats_join}
+        """
+
+    def _book_from_row(self, row):
+        """Turn a row from _select_books() into a book dictionary"""
+        book = dict(row)
+        if "rating_sum" in book:
+            self._with_rating_stats(book)
+        return book
+
+    def _shape(self, books):
+        """Drop the fields that were only selected for internal use"""
+        for book in books:
+            for field in list(book):
+                if field not in self.fields and field not in self.include:
+                    del book[field]
+        return books
+
+    def _with_rating_stats(self, book):
+        """Replace the raw BookStats columns with avg_rating and a histogram"""
+        rating_sum = book.pop("rating_sum")
+        if book["review_count"] > 0:
+            book["avg_rating"] = round(rating_sum / book["review_count"], 2)
+        else:
+            book["avg_rating"] = None
+
+        book["rating_histogram"] = {}
+        for rating in range(1, 6):
+            book["rating_histogram"][str(rating)] = book.pop(f"rating_{rating}")
+
+        return book
+
+    def _attach_related(self, db_cursor, books):
+        """Add the included categories and reviews lists to each book
+
+        Runs at most one query for categories and one for reviews no matter
+        how many books are passed in, and none for lists not included.
+        """
+        if not books:
+            return
+
+        # Every book gets its own (possibly empty) lists, in book order
+        books_by_id = {}
+        for book in books:
+            for name in self.INCLUDES:
+                if name in self.include:
+                    book[name] = []
+            books_by_id[book["id"]] = book
+
+        placeholders = ", ".join("?" * len(books_by_id))
+        params = tuple(books_by_id)
+
+        if "categories" in self.include:
+            # Get categories for the books
+            db_cursor.execute(f"""
+            SELECT
+                bc.book_id,
+                c.id,
+                c.category_name
+            FROM BookCategory bc
+            JOIN Category c ON c.id = bc.category_id
+            WHERE bc.book_id IN ({placeholders})
+            ORDER BY bc.id
+            """, params)
+
+            for category_row in db_cursor.fetchall():
+                category = dict(category_row)
+                books_by_id[category.pop("book_id")]["categories"].append(category)
+
+        if "reviews" in self.include:
+            # Get reviews for the books
+            db_cursor.execute(f"""
+            SELECT
+                r.book_id,
+                r.id,
+                r.rating,
+                r.review_text,
+                r.user_id,
+                u.username
+            FROM Review r
+            JOIN User u ON r.user_id = u.id
+            WHERE r.book_id IN ({placeholders})
+            ORDER BY r.id
+            """, params)
+
+            for review_row in db_cursor.fetchall():
+                review = dict(review_row)
+                books_by_id[review.pop("book_id")]["reviews"].append(review)
+
     def create(self, book_data):
         """Create a new book in the database"""
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to insert the new book
@@ -177,17 +587,69 @@ class Books():
             if "categories" in book_data and book_data["categories"]:
                 for category_id in book_data["categories"]:
                     db_cursor.execute("""
-                    INSERT INTO BookCategory (book_id, category_id)
+                    INSERT OR IGNORE INTO BookCategory (book_id, category_id)
                     VALUES (?, ?)
                     """, (id, category_id))
 
             return json.dumps(book_data)
 
+    def bulk_create(self, book_rows, batch_size=1000):
+        """Create many books and their categories using one transaction per batch
+
+        Accepts any iterable of book dictionaries. Rows that are missing
+        fields or break a constraint (e.g. a duplicate isbn) are skipped and
+        reported by their position; every other row is inserted.
+        """
+        report = {"created": 0, "errors": []}
+        conn = get_connection()
+
+        for batch in bulk.batches(book_rows, batch_size):
+            book_categories = []
+
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+
+                for index, row in batch:
+                    problem = bulk.missing_fields(row, ("title", "author", "isbn", "publication_date", "user_id"))
+                    if problem is not None:
+                        report["errors"].append({"index": index, "error": problem})
+                        continue
+
+                    # A savepoint per row lets one bad row fail on its own.
+                    # Books are inserted one at a time because each new id
+                    # is needed for the BookCategory rows.
+                    conn.execute("SAVEPOINT bulk_row")
+                    try:
+                        db_cursor = conn.execute("""
+                        INSERT INTO Book (title, author, isbn, publication_date, user_id)
+                        VALUES (?, ?, ?, ?, ?)
+                        """, (
+                            row["title"],
+                            row["author"],
+                            row["isbn"],
+                            row["publication_date"],
+                            row["user_id"]
+                        ))
+                        for category_id in row.get("categories") or []:
+                            book_categories.append((db_cursor.lastrowid, category_id))
+                        report["created"] += 1
+                    except bulk.ROW_ERRORS as error:
+                        conn.execute("ROLLBACK TO bulk_row")
+                        report["errors"].append({"index": index, "error": str(error)})
+                    conn.execute("RELEASE bulk_row")
+
+                # Add the category associations for the whole batch at once
+                conn.executemany("""
+                INSERT OR IGNORE INTO BookCategory (book_id, category_id)
+                VALUES (?, ?)
+                """, book_categories)
+
+        return json.dumps(report)
+
     def update(self, pk, book_data):
         """Update a book in the database"""
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to update the book
@@ -212,54 +674,175 @@ class Books():
             rows_affected = db_cursor.rowcount
 
             # If categories are provided, update the BookCategory table
-            if "categories" in book_data and book_data["categories"]:
-                # First, delete existing category associations
-                db_cursor.execute("""
-                DELETE FROM BookCategory
-                WHERE book_id = ?
-                """, (pk,))
-
-                # Then, add the new category associations
-                for category_id in book_data["categories"]:
-                    db_cursor.execute("""
-                    INSERT INTO BookCategory (book_id, category_id)
-                    VALUES (?, ?)
-                    """, (pk, category_id))
+            if rows_affected > 0 and "categories" in book_data and book_data["categories"]:
+                self._set_categories(db_cursor, pk, book_data["categories"])
 
             if rows_affected > 0:
                 return True
             else:
                 return False
 
-    def delete(self, pk):
-        """Delete a book from the database"""
+    def patch(self, pk, book_data, precondition=None):
+        """Update only the columns (and categories) present in book_data
+
+        `precondition`, when given, is called with the book's current JSON
+        as GET /books/{id} returns it; if it returns False nothing is
+        changed and PreconditionFailed is raised. Returns the updated
+        book's JSON, or None when there is no such book. Raises ValueError
+        for fields that cannot be patched and for values the database
+        rejects.
+        """
+        if not isinstance(book_data, dict):
+            raise ValueError("The request body must be a JSON object")
+        unknown = [field for field in book_data if field not in self.UPDATABLE and field != "categories"]
+        if unknown:
+            raise ValueError("Unknown fields: " + ", ".join(unknown))
+        categories = book_data.get("categories")
+        if "categories" in book_data and (
+                not isinstance(categories, list) or not all(isinstance(category_id, int) for category_id in categories)):
+            raise ValueError("categories must be a list of category ids")
+
+        columns = [column for column in self.UPDATABLE if column in book_data]
+
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
-            db_cursor = conn.cursor()
+        conn = get_connection()
+
+        if precondition is not None:
+            # Render the book for the check before taking the write lock, so
+            # other writers are not held up by the reads
+            with conn:
+                conn.execute("BEGIN")
+                checked_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                current = self._single_json(conn.cursor(), pk)
+            if current is None:
+                return None
+            if not precondition(current):
+                raise PreconditionFailed()
 
-            # First, delete any category associations
-            db_cursor.execute("""
-            DELETE FROM BookCategory
-            WHERE book_id = ?
-            """, (pk,))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            db_cursor = conn.cursor()
 
-            # Then, delete any reviews associated with this book
-            db_cursor.execute("""
-            DELETE FROM Review
-            WHERE book_id = ?
-            """, (pk,))
+            # data_version only changes when another connection commits. If
+            # one did since the check, the book may have changed: check again,
+            # this time under the lock.
+            if precondition is not None and conn.execute("PRAGMA data_version").fetchone()[0] != checked_version:
+                current = self._single_json(db_cursor, pk)
+                if current is None:
+                    return None
+                if not precondition(current):
+                    raise PreconditionFailed()
+
+            try:
+                if columns:
+                    # Write the SQL query to update just the supplied columns
+                    assignments = ", ".join(f"{column} = ?" for column in columns)
+                    db_cursor.execute(f"""
+                    UPDATE Book
+                    SET {assignments}
+                    WHERE id = ?
+                    """, (*[book_data[column] for column in columns], pk))
+                    if db_cursor.rowcount == 0:
+                        return None
+                else:
+                    db_cursor.execute("SELECT 1 FROM Book WHERE id = ?", (pk,))
+                    if db_cursor.fetchone() is None:
+                        return None
+
+                if categories is not None:
+                    self._set_categories(db_cursor, pk, categories)
+            except sqlite3.IntegrityError as error:
+                raise ValueError(str(error))
+
+        # The updated book is rendered after the commit, outside the lock
+        return self._single_json(conn.cursor(), pk)
+
+    def _set_categories(self, db_cursor, pk, category_ids):
+        """Make the book's categories exactly category_ids
+
+        Only the associations that change are deleted or inserted, so an
+        unchanged list writes nothing.
+        """
+        db_cursor.execute("""
+        SELECT category_id
+        FROM BookCategory
+        WHERE book_id = ?
+        """, (pk,))
+        current = {row["category_id"] for row in db_cursor.fetchall()}
+        wanted = list(dict.fromkeys(category_ids))
+
+        db_cursor.executemany("""
+        DELETE FROM BookCategory
+        WHERE book_id = ? AND category_id = ?
+        """, [(pk, category_id) for category_id in current.difference(wanted)])
+
+        db_cursor.executemany("""
+        INSERT OR IGNORE INTO BookCategory (book_id, category_id)
+        VALUES (?, ?)
+        """, [(pk, category_id) for category_id in wanted if category_id not in current])
 
-            # Finally, delete the book
-            db_cursor.execute("""
-            DELETE FROM Book
-            WHERE id = ?
-            """, (pk,))
-
-            # Check if a row was deleted
-            rows_affected = db_cursor.rowcount
+    def delete(self, pk):
+        """Delete a book from the database"""
+        # Open a connection to the database
+        with get_connection() as conn:
+            # The book, its categories and its reviews go in one transaction
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = self._delete_books(conn.cursor(), [pk])
 
-            if rows_affected > 0:
+            if deleted:
                 return True
             else:
-                return False
\ No newline at end of file
+                return False
+
+    def delete_many(self, book_ids):
+        """Delete several books, their categories and reviews in one transaction
+
+        Returns JSON listing the ids that were deleted and the ids that did
+        not match a book.
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+
+        # Open a connection to the database
+        with get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = self._delete_books(conn.cursor(), book_ids)
+
+        return json.dumps({
+            "deleted": deleted,
+            "missing": [book_id for book_id in book_ids if book_id not in deleted],
+        })
+
+    def _delete_books(self, db_cursor, book_ids):
+        """Delete books with their categories and reviews; returns the ids deleted"""
+        placeholders = ", ".join("?" * len(book_ids))
+        params = tuple(book_ids)
+
+        db_cursor.execute(f"""
+        SELECT id
+        FROM Book
+        WHERE id IN ({placeholders})
+        ORDER BY id
+        """, params)
+        deleted = [row["id"] for row in db_cursor.fetchall()]
+        if not deleted:
+            return []
+
+        # First, delete any category associations
+        db_cursor.execute(f"""
+        DELETE FROM BookCategory
+        WHERE book_id IN ({placeholders})
+        """, params)
+
+        # Then, delete any reviews associated with these books
+        db_cursor.execute(f"""
+        DELETE FROM Review
+        WHERE book_id IN ({placeholders})
+        """, params)
+
+        # Finally, delete the books
+        db_cursor.execute(f"""
+        DELETE FROM Book
+        WHERE id IN ({placeholders})
+        """, params)
+
+        return deleted
\ No newline at end of file
@@ -1,23 +1,36 @@
-import sqlite3
 import json
+from database import get_connection, get_read_connection
 
 
 class Categories():
 
-    def get_all(self):
-        """Get all categories from the database"""
+    def get_all(self, include_book_count=False):
+        """Get all categories from the database
+
+        With `include_book_count` each category also has the number of
+        books filed under it, read from CategoryStats.
+        """
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to get the information you want
-            db_cursor.execute("""
-            SELECT
-                c.id,
-                c.category_name
-            FROM Category c
-            """)
+            if include_book_count:
+                db_cursor.execute("""
+                SELECT
+                    c.id,
+                    c.category_name,
+                    COALESCE(s.book_count, 0) AS book_count
+                FROM Category c
+                LEFT JOIN CategoryStats s ON s.category_id = c.id
+                """)
+            else:
+                db_cursor.execute("""
+                SELECT
+                    c.id,
+                    c.category_name
+                FROM Category c
+                """)
             query_results = db_cursor.fetchall()
 
             # Initialize an empty list and then add each dictionary to it
@@ -27,11 +40,40 @@ class Categories():
 
             return json.dumps(categories)
 
+    def get_single(self, pk, books, limit, after=0):
+        """Get a category with its book count and a page of its books
+
+        `books` is the Books view that shapes the embedded books. Returns
+        the JSON and the cursor for the next page of books, or None, None
+        when there is no such category.
+        """
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            db_cursor.execute("""
+            SELECT
+                c.id,
+                c.category_name,
+                COALESCE(s.book_count, 0) AS book_count
+            FROM Category c
+            LEFT JOIN CategoryStats s ON s.category_id = c.id
+            WHERE c.id = ?
+            """, (pk,))
+
+            data = db_cursor.fetchone()
+            if data is None:
+                return None, None
+
+            category = dict(data)
+            category["books"], next_cursor = books.page_in_categories([pk], "any", limit, after)
+
+            return json.dumps(category), next_cursor
+
     def create(self, category_data):
         """Create a new category in the database"""
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to insert the new category
@@ -1,19 +1,28 @@
 import datetime
-import sqlite3
 import json
+from database import get_connection, get_read_connection, bulk, search, writer
 
 
 class Reviews():
 
-    def get_all(self):
-        """Get all reviews from the database"""
+    def get_all(self, limit, after=0, where=None, params=()):
+        """Get a page of reviews ordered by id
+
+        Returns the JSON for at most `limit` reviews whose id is greater than
+        `after`, and the cursor for the next page (None on the last page).
+        `where` is an optional SQL condition the reviews must also meet,
+        with its `params`, e.g. "r.user_id = ?" and (3,).
+        """
+        condition = "r.id > ?"
+        if where is not None:
+            condition = f"{where} AND {condition}"
+
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to get the information you want
-            db_cursor.execute("""
+            db_cursor.execute(f"""
             SELECT
                 r.id,
                 r.rating,
@@ -23,21 +32,177 @@ class Reviews():
                 b.title
             FROM Review r
             JOIN Book b ON r.book_id = b.id
-            """)
+            WHERE {condition}
+            ORDER BY r.id
+            LIMIT ?
+            """, (*params, after, limit + 1))
             query_results = db_cursor.fetchall()
 
             # Initialize an empty list and then add each dictionary to it
             reviews=[]
-            for row in query_results:
+            for row in query_results[:limit]:
                 reviews.append(dict(row))
 
-        return json.dumps(reviews)
+            # One extra row was requested to find out if another page exists
+            next_cursor = None
+            if len(query_results) > limit:
+                next_cursor = reviews[-1]["id"]
+
+        return json.dumps(reviews), next_cursor
+
+    def iter_page(self, limit, after=0, batch_size=500):
+        """Stream a page of reviews without holding the whole page in memory
+
+        Returns the cursor for the next page and a generator of review
+        dictionaries read from SQLite `batch_size` rows at a time.
+        """
+        reviews = self._iter_reviews(get_read_connection(), limit, after, batch_size)
+        # The first item is the cursor, which is sent before the body
+        next_cursor = next(reviews)
+        return next_cursor, reviews
+
+    def _iter_reviews(self, conn, limit, after, batch_size):
+        # The cursor and the rows are read in one transaction, so a write
+        # in between cannot make the cursor skip or repeat a row
+        conn.execute("BEGIN")
+        try:
+            # The cursor comes first. Finding it only walks the primary key
+            # index.
+            db_cursor = conn.cursor()
+            db_cursor.execute("""
+            SELECT r.id
+            FROM Review r
+            JOIN Book b ON r.book_id = b.id
+            WHERE r.id > ?
+            ORDER BY r.id
+            LIMIT 2 OFFSET ?
+            """, (after, limit - 1))
+            boundary = db_cursor.fetchall()
+
+            next_cursor = None
+            if len(boundary) == 2:
+                next_cursor = boundary[0]["id"]
+            yield next_cursor
+
+            db_cursor = conn.cursor()
+            db_cursor.execute("""
+            SELECT
+                r.id,
+                r.rating,
+                r.review_text,
+                r.book_id,
+                r.user_id,
+                b.title
+            FROM Review r
+            JOIN Book b ON r.book_id = b.id
+            WHERE r.id > ?
+            ORDER BY r.id
+            LIMIT ?
+            """, (after, limit))
+
+            while True:
+                rows = db_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.commit()
+
+    def search(self, text, limit, after=0):
+        """Find reviews whose text matches the search text
+
+        Results are ranked by bm25, best first. `after` is the number of
+        results already seen, and the cursor for the next page is returned
+        alongside the JSON (None on the last page). Returns None, None when
+        the text has nothing to search for.
+        """
+        match = search.match_expression(text)
+        if match is None:
+            return None, None
+
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            # Rank the matches in the search index, then join the few rows
+            # on this page back to Review and Book
+            db_cursor.execute("""
+            SELECT
+                r.id,
+                r.rating,
+                r.review_text,
+                r.book_id,
+                r.user_id,
+                b.title
+            FROM (
+                SELECT rowid, score
+                FROM (
+                    SELECT rowid, bm25(ReviewSearch) AS score
+                    FROM ReviewSearch
+                    WHERE ReviewSearch MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                )
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            ) AS matches
+            JOIN Review r ON r.id = matches.rowid
+            JOIN Book b ON r.book_id = b.id
+            ORDER BY matches.score
+            """, (match, search.MAX_RANKED_MATCHES, limit + 1, after))
+            query_results = db_cursor.fetchall()
+
+            reviews = []
+            for row in query_results[:limit]:
+                reviews.append(dict(row))
+
+            # One extra match was requested to find out if another page exists
+            next_cursor = None
+            if len(query_results) > limit:
+                next_cursor = after + limit
+
+            return json.dumps(reviews), next_cursor
+
+    def get_many(self, review_ids):
+        """Get several reviews by id in one query
+
+        Reviews come back in the order of `review_ids`; an id that does not
+        match a review gives {"id": id, "missing": true} in its place.
+        """
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            unique_ids = list(dict.fromkeys(review_ids))
+            placeholders = ", ".join("?" * len(unique_ids))
+            db_cursor.execute(f"""
+            SELECT
+                r.id,
+                r.rating,
+                r.review_text,
+                r.book_id,
+                r.user_id,
+                b.title
+            FROM Review r
+            JOIN Book b ON r.book_id = b.id
+            WHERE r.id IN ({placeholders})
+            """, tuple(unique_ids))
+
+            reviews_by_id = {}
+            for row in db_cursor.fetchall():
+                reviews_by_id[row["id"]] = dict(row)
+
+            reviews = []
+            for review_id in review_ids:
+                reviews.append(reviews_by_id.get(review_id, {"id": review_id, "missing": True}))
+
+            return json.dumps(reviews)
 
     def get_single(self, pk):
         """Get a single review by id"""
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_read_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to get the information you want
@@ -66,14 +231,13 @@ class Reviews():
                 return None
 
     def create(self, review_data):
-        """Create a new review in the database"""
-        # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
-            db_cursor = conn.cursor()
+        """Create a new review in the database
 
-            # Write the SQL query to insert the new review
-            db_cursor.execute("""
+        The insert goes through database.writer, which commits concurrent
+        reviews together when group commit is enabled.
+        """
+        # Write the SQL query to insert the new review
+        id = writer.insert("""
             INSERT INTO Review (book_id, user_id, rating, review_text)
             VALUES (?, ?, ?, ?)
             """, (
@@ -83,19 +247,50 @@ class Reviews():
                 review_data["review_text"]
             ))
 
-            # Get the id of the new review
-            id = db_cursor.lastrowid
+        # Add the id to the review data
+        review_data["id"] = id
+
+        return json.dumps(review_data)
+
+    def bulk_create(self, review_rows, batch_size=1000):
+        """Create many reviews using one transaction per batch
+
+        Accepts any iterable of review dictionaries. Rows that are missing
+        fields or break a constraint are skipped and reported by their
+        position; every other row is inserted.
+        """
+        report = {"created": 0, "errors": []}
+        conn = get_connection()
+
+        for batch in bulk.batches(review_rows, batch_size):
+            # Check the rows before sending them to the database
+            indexed_params = []
+            for index, row in batch:
+                problem = bulk.missing_fields(row, ("book_id", "user_id", "rating", "review_text"))
+                if problem is not None:
+                    report["errors"].append({"index": index, "error": problem})
+                    continue
+                indexed_params.append((index, (
+                    row["book_id"],
+                    row["user_id"],
+                    row["rating"],
+                    row["review_text"]
+                )))
 
-            # Add the id to the review data
-            review_data["id"] = id
+            if indexed_params:
+                created, errors = bulk.insert_batch(conn, """
+                INSERT INTO Review (book_id, user_id, rating, review_text)
+                VALUES (?, ?, ?, ?)
+                """, indexed_params)
+                report["created"] += created
+                report["errors"].extend(errors)
 
-            return json.dumps(review_data)
+        return json.dumps(report)
 
     def delete(self, pk):
         """Delete a review from the database"""
         # Open a connection to the database
-        with sqlite3.connect("./janesreviews.sqlite3") as conn:
-            conn.row_factory = sqlite3.Row
+        with get_connection() as conn:
             db_cursor = conn.cursor()
 
             # Write the SQL query to delete the review
@@ -0,0 +1,71 @@
+import json
+from database import get_read_connection
+from .reviews import Reviews
+
+
+class Users():
+
+    def get_single(self, pk):
+        """Get a user's public profile with their cached review count
+
+        The email address is never returned.
+        """
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            # Write the SQL query to get the information you want
+            db_cursor.execute("""
+            SELECT
+                u.id,
+                u.username,
+                COALESCE(s.review_count, 0) AS review_count
+            FROM User u
+            LEFT JOIN UserStats s ON s.user_id = u.id
+            WHERE u.id = ?
+            """, (pk,))
+
+            # Load the single result into memory
+            data = db_cursor.fetchone()
+
+            # Check if data was found
+            if data is not None:
+                return json.dumps(dict(data))
+            else:
+                return None
+
+    def get_reviews(self, pk, limit, after=0):
+        """Get a page of the reviews a user wrote, ordered by id
+
+        Returns the JSON and the cursor for the next page like
+        Reviews.get_all(), or None, None when there is no such user.
+        """
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            if not self.exists(db_cursor, pk):
+                return None, None
+
+            # Walks the (user_id, id) index from the cursor onwards
+            return Reviews().get_all(limit, after, "r.user_id = ?", (pk,))
+
+    def get_books(self, pk, books, limit, after=0):
+        """Get a page of the books a user added
+
+        `books` is the Books view that shapes them. Returns None, None when
+        there is no such user.
+        """
+        # Open a connection to the database
+        with get_read_connection() as conn:
+            db_cursor = conn.cursor()
+
+            if not self.exists(db_cursor, pk):
+                return None, None
+
+            # Walks the (user_id, id) index from the cursor onwards
+            return books.get_all(limit, after, "b.user_id = ?", (pk,))
+
+    def exists(self, db_cursor, pk):
+        db_cursor.execute("SELECT 1 FROM User WHERE id = ?", (pk,))
+        return db_cursor.fetchone() is not None